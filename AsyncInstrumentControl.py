@@ -0,0 +1,198 @@
+"""
+Asyncio counterparts of the InstrumentControl drivers
+Every driver method becomes awaitable and runs in a worker thread, so
+instruments on different buses or sockets overlap their I/O and settle time
+Commands sent through the same platform object (GPIB session or LTB
+transport) stay serialized by a per-platform lock
+
+Example:
+    osa = AsyncDriver(InstrumentControl.Yokogawa(16, 0))
+    wlm = AsyncDriver(InstrumentControl.Keysight86122(3, 2))
+    await osa.sweep()
+    wl = await wlm.getWL()
+"""
+# Import library for the event loop and worker threads
+import asyncio
+# Import library for the per-platform locks
+import threading
+# Import library for the unmatched peaks of the multi-tone scan
+import math
+
+# Locks serializing the commands sent through one platform object
+_platform_locks = {}
+_platform_locks_guard = threading.Lock()
+
+# Function returning the lock of the platform a driver talks through
+def platformLock(driver):
+    platform = getattr(driver, "platform", None)
+    if platform is None:
+        platform = getattr(driver, "platform_obj", None)
+    with _platform_locks_guard:
+        return _platform_locks.setdefault(id(platform), threading.Lock())
+
+# Awaitable wrapper around any InstrumentControl driver
+# Attributes are read straight from the driver, methods return coroutines
+class AsyncDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self._lock = platformLock(driver)
+
+    def _locked(self, method, args, kwargs):
+        with self._lock:
+            return method(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self.driver, name)
+        if not callable(attr):
+            return attr
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(self._locked, attr, args, kwargs)
+        return call
+
+# Coroutine constructing a driver in a worker thread, so the connection and
+# initialization pauses of several instruments overlap
+async def openAsync(driver_class, *args, **kwargs):
+    return AsyncDriver(await asyncio.to_thread(driver_class, *args, **kwargs))
+
+# Coroutine sweeping the OSA and returning its peak table
+# With accuracy (pm), the peak around center (nm) is measured in the two
+# stage fast peak mode and returned as "peak,uncertainty" (m)
+async def sweepPeaks(osa, peak_thresh, accuracy=None, center=None, span=10):
+    if accuracy is not None:
+        peak, uncertainty = await osa.fastPeak(center, accuracy, span, peak_thresh=peak_thresh)
+        return "%+.8E,%+.8E" % (peak, uncertainty)
+    await osa.sweep()
+    return await osa.getPeaks(peak_thresh)
+
+# Coroutine running a source/OSA/wavemeter calibration scan
+# For each wavelength the source is tuned, then the OSA sweep and the
+# wavemeter read run concurrently; record(wl, osa_peaks, wlm_reading) runs
+# in a worker thread while the source moves to the next wavelength
+# wl_scale converts the scan values to the source units (1e-9 for the TLS)
+# span (nm) and pts are only written when given; with accuracy (pm) the OSA
+# runs its fast peak mode over span instead (pts is then chosen by the OSA)
+# Returns the list of (wl, osa_peaks, wlm_reading)
+async def calibrationScan(source, osa, wlm, wls, peak_thresh=-20, span=None, pts=None, wl_scale=1, record=None, accuracy=None):
+    results = []
+    pending = None
+    for wl in wls:
+        if accuracy is not None:
+            await source.setWL(wl*wl_scale)
+            osa_scan = sweepPeaks(osa, peak_thresh, accuracy, wl, span or 10)
+        else:
+            await asyncio.gather(source.setWL(wl*wl_scale), osa.setSweepCenter(wl))
+            if span is not None:
+                await osa.setSweepSpan(span)
+            if pts is not None:
+                await osa.setSweepPoints(pts)
+            osa_scan = sweepPeaks(osa, peak_thresh)
+        osa_peaks, wlm_peak = await asyncio.gather(osa_scan, wlm.getWL())
+        if pending is not None:
+            await pending
+        if record is not None:
+            pending = asyncio.create_task(asyncio.to_thread(record, wl, osa_peaks, wlm_peak))
+        results.append((wl, osa_peaks, wlm_peak))
+    if pending is not None:
+        await pending
+    return results
+
+# Coroutine running an adaptive calibration scan over grid
+# (Calibration.AdaptiveGrid): the coarse points are measured first, then each
+# pass only measures the setpoints the grid asks for, until it converges
+# Returns the (wl, osa_peaks, wlm_reading) of every pass, in acquisition order
+async def adaptiveCalibrationScan(source, osa, wlm, grid, peak_thresh=-20, span=None, pts=None, wl_scale=1, record=None, accuracy=None):
+    results = []
+    wls = grid.initial()
+    while wls:
+        scan = await calibrationScan(source, osa, wlm, wls, peak_thresh, span, pts, wl_scale, record, accuracy)
+        for wl, osa_peaks, wlm_peak in scan:
+            grid.add(wl, float(osa_peaks.split(",")[0]), float(wlm_peak.split(",")[0]))
+        results.extend(scan)
+        wls = grid.next()
+    return results
+
+# Function attributing measured peaks (m) to the closest setpoint (m), a
+# peak further than tol from every setpoint is dropped
+# Returns one peak per setpoint, NaN where none matched
+def attributePeaks(setpoints, peaks, tol):
+    matched = [math.nan]*len(setpoints)
+    for peak in peaks:
+        i = min(range(len(setpoints)), key=lambda i: abs(setpoints[i] - peak))
+        if abs(setpoints[i] - peak) > tol:
+            continue
+        if math.isnan(matched[i]) or abs(peak - setpoints[i]) < abs(matched[i] - setpoints[i]):
+            matched[i] = peak
+    return matched
+
+# Coroutine running a calibration scan with several TLS channels lit at once
+# wls (nm) is cut into blocks of neighbouring wavelengths narrow enough for
+# one sweep, each block split into one interleaved sub-scan per channel, so
+# the lines of a sweep are len(block)/len(channels) steps apart; each sweep
+# covers every line (span nm, default the line spread + 2 nm) and the OSA
+# WDM and wavemeter peaks are attributed to their channel by proximity
+# The sweep points keep the sampling step of the single-tone scan (step nm,
+# 2 nm over 5000 points), so a block spans at most the 50001 points of the
+# OSA at that step less 2 nm (about 18 nm), or span less 2 nm; should a
+# sweep still need more points, the OSA sweeps each line over 2 nm instead
+# pts, when given, sets the points of every sweep and disables the zoom
+# record(wl, osa_peak, wlm_peak) receives one call per line, peaks formatted
+# like the instrument replies; returns the list of (wl, osa_peak, wlm_peak)
+async def multiToneScan(source, osa, wlm, wls, channels=(1, 2, 3, 4), peak_thresh=-20, span=None, pts=None,
+                        wl_scale=1, record=None, step=2/4999):
+    wls = sorted(wls)
+    channels = list(channels)
+    max_spread = max((span or ((pts or 50001) - 1)*step) - 2, 0)
+    blocks = []
+    for wl in wls:
+        if blocks and wl - blocks[-1][0] <= max_spread:
+            blocks[-1].append(wl)
+        else:
+            blocks.append([wl])
+    scan = []
+    for block in blocks:
+        steps = -(-len(block)//len(channels))
+        scan.extend({ch: block[i + k*steps] for k, ch in enumerate(channels) if i + k*steps < len(block)}
+                    for i in range(steps))
+    results = []
+
+    async def configure(center, width, n):
+        await osa.setSweepCenter(round(center, 4))
+        await osa.setSweepSpan(width)
+        # AQ6370D sweeps take 101 to 50001 points
+        await osa.setSweepPoints(int(min(max(n, 101), 50001)))
+
+    # Channels are only switched when their state changes
+    lit = set()
+    for tones in scan:
+        for ch in channels:
+            if ch in tones and ch not in lit:
+                await source.turnOn(ch)
+                lit.add(ch)
+            elif ch not in tones and ch in lit:
+                await source.turnOff(ch)
+                lit.discard(ch)
+        setpoints = list(tones.values())
+        spread = max(setpoints) - min(setpoints)
+        width = round(span or spread + 2, 4)
+        windows = [((max(setpoints) + min(setpoints))/2, width, pts or math.ceil(width/step - 1e-9) + 1)]
+        if pts is None and windows[0][2] > 50001:
+            windows = [(wl, 2, math.ceil(2/step - 1e-9) + 1) for wl in setpoints]
+        await asyncio.gather(source.setWLs({ch: wl*wl_scale for ch, wl in tones.items()}), configure(*windows[0]))
+        # The wavemeter reads every line while the OSA sweeps its windows
+        wlm_read = asyncio.ensure_future(wlm.getWLs())
+        osa_peaks = []
+        for k, window in enumerate(windows):
+            if k:
+                await configure(*window)
+            await osa.sweep()
+            osa_peaks.extend(await osa.getChannelPeaks(peak_thresh))
+        wlm_peaks = await wlm_read
+        # Lines are at least (steps x scan step) apart, peaks are matched within half of that
+        tol = (spread/(len(setpoints) - 1)/2 if len(setpoints) > 1 else 1)*1e-9
+        setpoints_m = [wl*1e-9 for wl in setpoints]
+        for wl, osa_peak, wlm_peak in zip(setpoints, attributePeaks(setpoints_m, osa_peaks, tol),
+                                          attributePeaks(setpoints_m, wlm_peaks, tol)):
+            if record is not None:
+                await asyncio.to_thread(record, wl, "%+.8E" % osa_peak, "%+.8E" % wlm_peak)
+            results.append((wl, osa_peak, wlm_peak))
+    return results
@@ -0,0 +1,104 @@
+"""
+End-to-end timing benchmark of the InstrumentControl drivers
+Replays the loops of osa_calibration.py, Scrambling_speed.py and
+no_internal_scrambling.py (with reduced counts) against the simulated
+backends of InstrumentSimulator and reports commands per second, per-step
+latency and total campaign time
+
+Usage:
+    python Benchmark.py                      # every campaign
+    python Benchmark.py calibration          # calibration, scrambling and/or no_scrambling
+"""
+import InstrumentSimulator
+import os
+# GPIB instruments are served by pyvisa-sim unless another backend is forced
+os.environ.setdefault("PYVISA_LIBRARY", InstrumentSimulator.SIM_PROFILE+"@sim")
+import sys
+import time
+import asyncio
+import tempfile
+import numpy as np
+import InstrumentControl
+import AsyncInstrumentControl
+
+# Function printing the timing summary of a campaign
+def report(name, steps, commands, total):
+    steps = np.asarray(steps)*1e3
+    print("=== "+name)
+    print("Steps:            "+str(len(steps)))
+    print("Step latency:     mean "+str(round(steps.mean(), 2))+" ms, p50 "+str(round(np.percentile(steps, 50), 2))
+          +" ms, p95 "+str(round(np.percentile(steps, 95), 2))+" ms, max "+str(round(steps.max(), 2))+" ms")
+    print("Commands:         "+str(commands)+" ("+str(round(commands/total, 1))+" cmd/s)")
+    print("Campaign time:    "+str(round(total, 3))+" s")
+
+# osa_calibration.py: T100 retune, Yokogawa sweep + peaks, wavemeter read
+def benchCalibration(n_points=21, latency=0.002, retune=0.3, sweep=0.2):
+    async def run():
+        t100shp, osa, wlm = await asyncio.gather(
+            AsyncInstrumentControl.openAsync(InstrumentControl.T100, 9, 1, settle=True),
+            AsyncInstrumentControl.openAsync(InstrumentControl.Yokogawa, 16, 0),
+            AsyncInstrumentControl.openAsync(InstrumentControl.Keysight86122, 3, 2))
+        t100shp.driver.platform = InstrumentSimulator.SimLatency(t100shp.driver.platform, latency, {"L=": retune})
+        osa.driver.platform = InstrumentSimulator.SimLatency(osa.driver.platform, latency, {":INITiate": sweep})
+        wlm.driver.platform = InstrumentSimulator.SimLatency(wlm.driver.platform, latency)
+        stamps = [time.perf_counter()]
+        await AsyncInstrumentControl.calibrationScan(t100shp, osa, wlm, np.linspace(1440, 1640, n_points),
+                                                     span=2, pts=5000,
+                                                     record=lambda *r: stamps.append(time.perf_counter()))
+        commands = sum(d.driver.platform.commands for d in (t100shp, osa, wlm))
+        return np.diff(stamps), commands, stamps[-1] - stamps[0]
+    report("osa_calibration", *asyncio.run(run()))
+
+# Scrambling_speed.py: rep x nsops x disc_spd in-band acquisitions
+def benchScrambling(rep=2, nsops=(1000, 2000, 3000, 4000, 5000), disc_spd=(0,), latency=0.0005, sop_time=1e-4):
+    modules = {"4": InstrumentSimulator.SimTLS(channels=1), "5": InstrumentSimulator.SimOSA(sop_time, 0.05)}
+    with InstrumentSimulator.LTBSimulator(modules, latency) as sim:
+        ltb8 = InstrumentControl.LTB(*sim.address).platform
+        mpc_201 = InstrumentControl.MPC_201(5)
+        mpc_201.platform = InstrumentSimulator.SimLatency(mpc_201.platform, 0.002)
+        osa = InstrumentControl.OSA("LTB8", ltb8, 5)
+        InstrumentControl.DFB("LTB8", ltb8, 4)
+        with tempfile.TemporaryDirectory() as tmp:
+            start_commands = sim.commands
+            steps = []
+            start = time.perf_counter()
+            for k in range(rep):
+                for nsop in nsops:
+                    for ds in disc_spd:
+                        t0 = time.perf_counter()
+                        mpc_201.setDisc()
+                        mpc_201.setRate(ds)
+                        osa.inband_Analysis([1545, 1555], nsop, tmp+"/disc_"+str(ds)+"_"+str(k)+"_"+str(nsop)+".xosawdm")
+                        steps.append(time.perf_counter() - t0)
+            total = time.perf_counter() - start
+            report("Scrambling_speed", steps, sim.commands - start_commands + mpc_201.platform.commands, total)
+
+# no_internal_scrambling.py: scr_arr x n_acq short acquisitions
+def benchNoScrambling(n_rates=15, n_acq=20, n_av=2, latency=0.0005, sop_time=1e-4):
+    modules = {"4": InstrumentSimulator.SimTLS(channels=1), "5": InstrumentSimulator.SimOSA(sop_time, 0.05)}
+    with InstrumentSimulator.LTBSimulator(modules, latency) as sim:
+        ltb8 = InstrumentControl.LTB(*sim.address).platform
+        mpc_201 = InstrumentControl.MPC_201(5)
+        mpc_201.platform = InstrumentSimulator.SimLatency(mpc_201.platform, 0.002)
+        osa = InstrumentControl.OSA("LTB8", ltb8, 5)
+        InstrumentControl.DFB("LTB8", ltb8, 4)
+        scr_arr = 2**(np.linspace(0, n_rates-1, n_rates))-1
+        with tempfile.TemporaryDirectory() as tmp:
+            start_commands = sim.commands
+            steps = []
+            start = time.perf_counter()
+            for scrambling_rate in scr_arr:
+                for i in range(n_acq):
+                    t0 = time.perf_counter()
+                    mpc_201.setRate(scrambling_rate)
+                    mpc_201.setRate(0)
+                    osa.inband_Analysis([1545, 1555], n_av, tmp+"/av_"+str(scrambling_rate)+"_"+str(i)+".xosawdm")
+                    steps.append(time.perf_counter() - t0)
+            total = time.perf_counter() - start
+            report("no_internal_scrambling", steps, sim.commands - start_commands + mpc_201.platform.commands, total)
+
+CAMPAIGNS = {"calibration": benchCalibration, "scrambling": benchScrambling, "no_scrambling": benchNoScrambling}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or CAMPAIGNS:
+        CAMPAIGNS[name]()
@@ -0,0 +1,222 @@
+"""
+OSA wavelength calibration analysis and correction model
+Turns the setpoint / OSA peak / wavemeter results of osa_calibration.py into
+a smooth correction of the OSA wavelength error (OSA - WLM), fitted as a
+polynomial or a smoothing spline
+
+The fitted correction is tabulated once on a dense grid, applying it to any
+number of peaks is a single np.interp; models are saved per OSA *IDN? and
+picked up by InstrumentControl.Yokogawa, which corrects getPeaks()
+AdaptiveGrid plans calibration scans that start coarse and only refine where
+the error curve needs it (see AsyncInstrumentControl.adaptiveCalibrationScan)
+
+Example:
+    setpoint, osa, wlm = Calibration.loadResults("YOKOGAWA,AQ6370D,91P822360,01.0")
+    model = Calibration.fit(osa, wlm, kind="poly", deg=5, idn="YOKOGAWA,AQ6370D,91P822360,01.0")
+    model.printReport()
+    model.save()
+"""
+# Import library for the model files
+import json
+# Import library for the model file names
+import re
+from pathlib import Path
+import numpy as np
+import ResultStore
+
+# Default folder of the saved models
+MODEL_DIR = Path.home() / ".exfo_automation" / "calibration"
+
+# Function loading (setpoint, osa, wlm) arrays from a ResultStore folder or
+# a legacy text result file
+def loadResults(path):
+    path = Path(path)
+    if path.is_dir():
+        data = ResultStore.load(path)
+    else:
+        data = ResultStore.importLegacy(path)
+    return np.asarray(data["setpoint"]), np.asarray(data["osa"]), np.asarray(data["wlm"])
+
+# Function returning the file name of the model of an instrument
+def modelPath(idn, folder=None):
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", idn.strip())
+    return Path(folder or MODEL_DIR) / (name+".json")
+
+# Wavelength correction of one OSA, tabulated on a dense wavelength grid
+# apply() returns the corrected wavelengths (same unit as the fit, m)
+class CalibrationModel:
+    def __init__(self, grid, table, idn="", kind="", stats=None):
+        self.grid = np.asarray(grid, dtype=np.float64)
+        self.table = np.asarray(table, dtype=np.float64)
+        self.idn = idn
+        self.kind = kind
+        self.stats = stats or {}
+
+    # Method returning the error (OSA - WLM) expected at wl
+    def error(self, wl):
+        return np.interp(wl, self.grid, self.table)
+
+    # Method correcting one wavelength or an array of wavelengths
+    def apply(self, wl):
+        return wl - np.interp(wl, self.grid, self.table)
+
+    def save(self, path=None):
+        path = Path(path) if path else modelPath(self.idn)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"idn": self.idn, "kind": self.kind, "stats": self.stats,
+                       "grid": self.grid.tolist(), "table": self.table.tolist()}, f)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            d = json.load(f)
+        return cls(d["grid"], d["table"], d["idn"], d["kind"], d["stats"])
+
+    def printReport(self):
+        print("Calibration model of "+self.idn+" ("+self.kind+")")
+        for name, value in self.stats.items():
+            print("  "+name+": "+str(value))
+
+# Function returning the saved model of an instrument, None if there is none
+def forInstrument(idn, folder=None):
+    path = modelPath(idn, folder)
+    if not path.exists():
+        return None
+    return CalibrationModel.load(path)
+
+# Function fitting the OSA error (osa - wlm) against the OSA reading
+# kind "poly" fits a polynomial of degree deg, kind "spline" a smoothing
+# spline (smoothing as in scipy UnivariateSpline, default n*std^2 of the
+# error); the fit is tabulated on n_grid points over the measured range
+def fit(osa, wlm, kind="poly", deg=3, smoothing=None, idn="", n_grid=4096):
+    osa = np.asarray(osa, dtype=np.float64)
+    wlm = np.asarray(wlm, dtype=np.float64)
+    valid = np.isfinite(osa) & np.isfinite(wlm)
+    osa = osa[valid]
+    wlm = wlm[valid]
+    order = np.argsort(osa)
+    osa = osa[order]
+    err = osa - wlm[order]
+    grid = np.linspace(osa[0], osa[-1], n_grid)
+    if kind == "poly":
+        poly = np.polynomial.Polynomial.fit(osa, err, deg)
+        model_err = poly(osa)
+        table = poly(grid)
+        kind = "poly"+str(deg)
+    elif kind == "spline":
+        from scipy.interpolate import UnivariateSpline
+        if smoothing is None:
+            smoothing = len(osa)*np.var(err - np.polynomial.Polynomial.fit(osa, err, 3)(osa))
+        spline = UnivariateSpline(osa, err, s=smoothing)
+        model_err = spline(osa)
+        table = spline(grid)
+    else:
+        raise ValueError("Unknown calibration model kind: "+str(kind))
+    residual = err - model_err
+    stats = {"points": int(len(osa)),
+             "range_nm": [float(osa[0]*1e9), float(osa[-1]*1e9)],
+             "raw_error_rms_pm": float(np.sqrt(np.mean(err**2))*1e12),
+             "raw_error_max_pm": float(np.max(np.abs(err))*1e12),
+             "residual_rms_pm": float(np.sqrt(np.mean(residual**2))*1e12),
+             "residual_std_pm": float(np.std(residual)*1e12),
+             "residual_max_pm": float(np.max(np.abs(residual))*1e12)}
+    return CalibrationModel(grid, table, idn, kind, stats)
+
+# Adaptive wavelength grid of a calibration scan
+# Starts from coarse points over [start, stop] (nm) and, after each pass,
+# refines the intervals next to a point whose error (OSA - WLM) is off by
+# more than tol (pm) from the line through its neighbours (fast changing
+# error) or from a polynomial fit of degree deg over all points (large fit
+# residual); intervals are not split below min_step (nm), new setpoints are
+# rounded to resolution (nm) and the scan stops when no interval needs
+# refining (converged) or after max_points setpoints; setpoints without a
+# valid reading are not proposed again and count against max_points
+# tol should stay above the peak repeatability of the OSA and wavemeter,
+# otherwise noise alone refines the grid down to min_step; tol=None derives
+# it from the coarse pass, noise_factor times the rms residual of the
+# polynomial fit of its points
+#
+# Example:
+#     grid = Calibration.AdaptiveGrid(1440, 1640, coarse=26, tol=None, min_step=1)
+#     wls = grid.initial()
+#     while wls:
+#         for wl in wls: grid.add(wl, osa_peak, wlm_peak)
+#         wls = grid.next()
+class AdaptiveGrid:
+    def __init__(self, start, stop, coarse=21, tol=1.0, min_step=1.0, deg=5, resolution=0.01, max_points=201,
+                 noise_factor=3):
+        self.start = start
+        self.stop = stop
+        self.coarse = coarse
+        self.tol = tol
+        self.noise_factor = noise_factor
+        self.min_step = min_step
+        self.deg = deg
+        self.resolution = resolution
+        self.max_points = max_points
+        self.points = {}
+        self.attempted = set() # every setpoint proposed or measured
+        self.passes = 0
+        self.converged = False
+
+    def initial(self):
+        self.passes = 1
+        wls = list(np.round(np.linspace(self.start, self.stop, self.coarse)/self.resolution)*self.resolution)
+        self.attempted.update(wls)
+        return wls
+
+    # Method recording the OSA and wavemeter peaks (m) measured at setpoint wl (nm)
+    def add(self, wl, osa, wlm):
+        self.attempted.add(wl)
+        if np.isfinite(osa) and np.isfinite(wlm):
+            self.points[wl] = osa - wlm
+
+    # Method returning the indexes of the points flagged for refinement
+    def _flagged(self, wl, err):
+        tol = self.tol*1e-12
+        flagged = np.zeros(len(wl), dtype=bool)
+        # Deviation of each interior point from the line through its neighbours
+        frac = (wl[1:-1] - wl[:-2])/(wl[2:] - wl[:-2])
+        line = err[:-2] + frac*(err[2:] - err[:-2])
+        flagged[1:-1] |= np.abs(err[1:-1] - line) > tol
+        # Residual against the current fit
+        if len(wl) > self.deg + 1:
+            poly = np.polynomial.Polynomial.fit(wl, err, self.deg)
+            flagged |= np.abs(err - poly(wl)) > tol
+        return flagged
+
+    # Method returning the setpoints of the next pass, [] once the scan is done
+    # Passes alternate direction so the source does not jump back to the start
+    def next(self):
+        wl = np.array(sorted(self.points))
+        err = np.array([self.points[w] for w in wl])
+        if len(wl) < 3:
+            self.converged = False
+            return []
+        if self.tol is None:
+            residual = err - np.polynomial.Polynomial.fit(wl, err, min(self.deg, len(wl) - 1))(wl)
+            self.tol = self.noise_factor*float(np.sqrt(np.mean(residual**2)))*1e12
+        flagged = self._flagged(wl, err)
+        # Both intervals around a flagged point are split at their middle
+        split = np.zeros(len(wl) - 1, dtype=bool)
+        split |= flagged[:-1]
+        split |= flagged[1:]
+        split &= np.diff(wl) >= 2*self.min_step
+        mids = np.round((wl[:-1][split] + wl[1:][split])/2/self.resolution)*self.resolution
+        mids = [m for m in mids if m not in self.attempted]
+        self.converged = not flagged.any()
+        room = self.max_points - len(self.attempted)
+        if not mids or room <= 0:
+            return []
+        self.passes += 1
+        mids = mids[:room]
+        self.attempted.update(mids)
+        return mids[::-1] if self.passes % 2 == 0 else mids
+
+    def printSummary(self):
+        failed = len(self.attempted) - len(self.points)
+        print("Adaptive scan: "+str(len(self.points))+" points in "+str(self.passes)+" passes"
+              +(" ("+str(failed)+" without reading), " if failed else ", ")
+              +("converged" if self.converged else "not converged")+" at "+str(self.tol)+" pm")
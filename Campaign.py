@@ -0,0 +1,375 @@
+"""
+Campaign execution helpers
+1. MultiPlatformRunner: runs one study over several LTB/IQS chassis, one
+   worker (thread or process) per chassis, with results and progress
+   aggregated in the calling thread
+2. Sweep: declarative sweep specification whose planner orders the points
+   to minimise the changeover time of slow settings
+3. Journal: on-disk record of the completed points, a restarted campaign
+   resumes at the first unfinished point
+
+Example:
+    def setup(spec):
+        ltb8 = InstrumentControl.LTB(spec["address"], 5025).platform
+        return InstrumentControl.OSA("LTB8", ltb8, spec["osa"])
+
+    def step(osa, point):
+        osa.inband_Analysis([1545, 1555], point["nsop"], point["file"])
+
+    runner = Campaign.MultiPlatformRunner([{"name": "A", "address": "169.254.244.64", "osa": 5},
+                                           {"name": "B", "address": "169.254.244.65", "osa": 5}], setup, step)
+    results = runner.run([{"nsop": n, "file": ...} for n in nsops])
+"""
+# Import libraries for the workers and their queues
+import multiprocessing
+import queue
+import threading
+import time
+# Import libraries for the sweep planner
+import itertools
+import random
+# Import libraries for the checkpoint journal
+import json
+import os
+
+# Marker sent by a worker when it has no more points to run
+_DONE = "done"
+# Error marker of a point skipped by the skip predicate
+_SKIPPED = "skipped"
+# Task sent to a worker once no point of its queue is outstanding
+_STOP = "stop"
+
+# Worker body, shared by the thread and process modes
+# Points are run until the _STOP task, so a point requeued by a retired
+# chassis is still picked up by the others
+# Connection errors requeue the point and retire the chassis, other errors
+# are reported and the worker moves on to the next point
+def _worker(name, spec, setup, step, teardown, skip, tasks, results):
+    try:
+        ctx = setup(spec)
+    except Exception as e:
+        results.put((name, None, None, "setup failed: "+repr(e)))
+        results.put((name, _DONE, None, None))
+        return
+    try:
+        while True:
+            task = tasks.get()
+            if task == _STOP:
+                break
+            index, point = task
+            if skip is not None and skip(point):
+                results.put((name, index, None, _SKIPPED))
+                continue
+            try:
+                results.put((name, index, step(ctx, point), None))
+            except (ConnectionError, TimeoutError, OSError) as e:
+                tasks.put((index, point))
+                results.put((name, None, None, "chassis retired: "+repr(e)))
+                break
+            except Exception as e:
+                results.put((name, index, None, repr(e)))
+    finally:
+        if teardown is not None:
+            teardown(ctx)
+        results.put((name, _DONE, None, None))
+
+# Runs a study over several chassis in parallel
+# chassis is a list of specs (dicts with at least a "name"), setup(spec)
+# builds the instruments of one chassis inside its worker and returns the
+# context passed to step(ctx, point), teardown(ctx) is optional
+# Points are pulled from a shared queue, so a slow chassis only runs fewer
+# of them; with replicate=True every chassis runs the whole study instead
+# mode is "thread" (default) or "process" (setup, step and results must
+# then be picklable); on_result(chassis, index, point, result, error) is
+# called in the calling thread as results arrive
+# journal is an optional Journal: points it holds are not run again, their
+# recorded results are passed to on_result (chassis "journal") so the
+# aggregates are rebuilt, and every completed point is recorded in it
+# skip(point) is checked by the workers before each point, returning True
+# skips it (early stopping, e.g. RunningStats.done); skipped points are
+# listed in self.skipped, thread mode only sees on_result updates
+class MultiPlatformRunner:
+    def __init__(self, chassis, setup, step, teardown=None, mode="thread", replicate=False, on_result=None, verbose=True,
+                 skip=None, journal=None):
+        self.chassis = chassis
+        self.setup = setup
+        self.step = step
+        self.teardown = teardown
+        self.mode = mode
+        self.replicate = replicate
+        self.on_result = on_result
+        self.verbose = verbose
+        self.skip = skip
+        self.journal = journal
+        self.results = []
+        self.errors = []
+        self.skipped = []
+
+    # Method running the points, returns [(chassis, index, point, result)]
+    # sorted by point index; failed points are listed in self.errors
+    def run(self, points):
+        points = list(points)
+        todo = list(enumerate(points))
+        if self.journal is not None:
+            todo = []
+            for index, point in enumerate(points):
+                if self.journal.done(point):
+                    result = self.journal.result(point)
+                    self.results.append(("journal", index, point, result))
+                    if self.on_result is not None:
+                        self.on_result("journal", index, point, result, None)
+                else:
+                    todo.append((index, point))
+        if self.mode == "process":
+            ctx = multiprocessing.get_context("spawn")
+            make_queue = ctx.Queue
+            make_worker = lambda args: ctx.Process(target=_worker, args=args, daemon=True)
+        else:
+            make_queue = queue.Queue
+            make_worker = lambda args: threading.Thread(target=_worker, args=args, daemon=True)
+        results = make_queue()
+        shared = None if self.replicate else make_queue()
+        # Task queues (one per chassis, or one shared keyed None), the chassis
+        # pulling from each and its points not reported yet: a point requeued
+        # by a retired chassis stays outstanding, the workers of a queue are
+        # only stopped once it has none left
+        queues = {}
+        members = {}
+        pending = {}
+        workers = []
+        for spec in self.chassis:
+            key = spec["name"] if self.replicate else None
+            tasks = make_queue() if self.replicate else shared
+            if key not in queues:
+                for item in todo:
+                    tasks.put(item)
+                queues[key] = tasks
+                pending[key] = len(todo)
+            members.setdefault(key, []).append(spec["name"])
+            workers.append(make_worker((spec["name"], spec, self.setup, self.step, self.teardown, self.skip, tasks, results)))
+        def stop(key):
+            for _ in members[key]:
+                queues[key].put(_STOP)
+        for w in workers:
+            w.start()
+        for key in queues:
+            if not pending[key]:
+                stop(key)
+
+        total = len(todo)*(len(self.chassis) if self.replicate else 1)
+        done = 0
+        running = len(workers)
+        start = time.perf_counter()
+        while running:
+            name, index, result, error = results.get()
+            if index == _DONE:
+                running -= 1
+                continue
+            if index is not None:
+                key = name if self.replicate else None
+                pending[key] -= 1
+                if not pending[key]:
+                    stop(key)
+            if error == _SKIPPED:
+                self.skipped.append((name, index, points[index]))
+                done += 1
+                continue
+            if index is not None:
+                point = points[index]
+                if error is None:
+                    self.results.append((name, index, point, result))
+                    if self.journal is not None:
+                        self.journal.record(point, result)
+                else:
+                    self.errors.append((name, index, point, error))
+                done += 1
+                if self.on_result is not None:
+                    self.on_result(name, index, point, result, error)
+            else:
+                self.errors.append((name, None, None, error))
+            if self.verbose:
+                elapsed = time.perf_counter() - start
+                print("["+name+"] "+str(done)+"/"+str(total)+" points, "+str(round(elapsed, 1))+" s"
+                      +(" - "+error if error else ""))
+        for w in workers:
+            w.join()
+        # Points left over when every chassis of a queue was retired
+        for key, tasks in queues.items():
+            if not pending[key]:
+                continue
+            while True:
+                try:
+                    task = tasks.get(timeout=0.1)
+                except queue.Empty:
+                    break
+                if task != _STOP:
+                    self.errors.append((key, task[0], task[1], "not run"))
+        self.results.sort(key=lambda r: r[1])
+        return self.results
+
+# Append-only journal of the completed points of a campaign, one JSON line
+# per point with its result (JSON values, other types are stored as repr())
+# Each line is fsynced, a line cut by a crash is ignored on reopen
+#
+# Example:
+#     journal = Campaign.Journal("C:/OSA/2024-04-18_journal.jsonl")
+#     for point in points:
+#         if journal.done(point): continue
+#         ...
+#         journal.record(point, result)
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self._results = {}
+        cut = False
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    cut = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._results[self._key(entry["point"])] = entry["result"]
+        self._file = open(path, "a")
+        if cut:
+            self._file.write("\n")
+
+    # Points are matched on their JSON form, tuples and lists alike
+    def _key(self, point):
+        return json.dumps(point, sort_keys=True, default=repr)
+
+    def done(self, point):
+        return self._key(point) in self._results
+
+    def result(self, point):
+        return self._results.get(self._key(point))
+
+    def record(self, point, result=None):
+        line = json.dumps({"point": point, "result": result}, sort_keys=True, default=repr)
+        self._file.write(line+"\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._results[self._key(point)] = json.loads(line)["result"]
+
+    # Method returning the completed (point, result) pairs
+    def items(self):
+        return [(json.loads(key), result) for key, result in self._results.items()]
+
+    def __len__(self):
+        return len(self._results)
+
+    def close(self):
+        self._file.close()
+
+# Function formatting a duration in s as H:MM:SS
+def _hms(seconds):
+    seconds = int(round(seconds))
+    return str(seconds//3600)+":"+str(seconds//60 % 60).zfill(2)+":"+str(seconds % 60).zfill(2)
+
+# Declarative sweep over the product of parameter values
+# parameters maps each name to its list of values, repetitions adds a "rep"
+# parameter; costs maps a name to the time (s) of changing it, either a
+# constant or a function cost(old, new) (old is None for the first point);
+# point_time is the time of one acquisition, constant or function(point)
+# Constraints: names in outer stay the outermost loops in that order (for
+# instance "rep" to interleave repetitions over the whole grid), names in
+# randomize get their values shuffled on every pass
+# plan() nests the other parameters with the most expensive outermost and
+# walks the grid back and forth (serpentine), so slow settings change as
+# rarely and as little as possible
+#
+# Example:
+#     sweep = Campaign.Sweep({"nsop": [1000, 2000, 5000], "rate": [0, 1, 3]}, repetitions=5,
+#                            costs={"rate": 2.0}, point_time=lambda p: p["nsop"]*0.05, outer=["rep"])
+#     for point in sweep.plan(): ...
+class Sweep:
+    def __init__(self, parameters, repetitions=1, costs=None, point_time=0, outer=(), randomize=(), seed=None):
+        self.parameters = {name: list(values) for name, values in parameters.items()}
+        if repetitions > 1 or "rep" in outer:
+            self.parameters["rep"] = list(range(repetitions))
+        self.costs = costs or {}
+        self.point_time = point_time
+        self.outer = list(outer)
+        self.randomize = set(randomize)
+        self.seed = seed
+        self.order = None
+
+    def _cost(self, name, old, new):
+        cost = self.costs.get(name, 0)
+        return cost(old, new) if callable(cost) else cost
+
+    # Method returning the points of a loop nesting (outer to inner) as tuples
+    def _sequence(self, names, rng):
+        if not names:
+            return [()]
+        values = list(self.parameters[names[0]])
+        if names[0] in self.randomize:
+            rng.shuffle(values)
+        points = []
+        for i, value in enumerate(values):
+            inner = self._sequence(names[1:], rng)
+            if i % 2:
+                inner.reverse()
+            points.extend((value,)+rest for rest in inner)
+        return points
+
+    # Method returning the changeover and acquisition times of points
+    def _times(self, names, points):
+        changeover = 0
+        acquisition = 0
+        prev = None
+        for point in points:
+            for i, name in enumerate(names):
+                if prev is None or prev[i] != point[i]:
+                    changeover += self._cost(name, None if prev is None else prev[i], point[i])
+            prev = point
+            if callable(self.point_time):
+                acquisition += self.point_time(dict(zip(names, point)))
+            else:
+                acquisition += self.point_time
+        return changeover, acquisition
+
+    # Method returning the planned points as a list of dicts
+    def plan(self):
+        free = [name for name in self.parameters if name not in self.outer]
+        if len(free) <= 6:
+            candidates = itertools.permutations(free)
+        else:
+            # Too many orders to try, nest by decreasing cost of one change
+            candidates = [sorted(free, key=lambda n: -sum(self._cost(n, a, b) for a, b in
+                                                          zip(self.parameters[n], self.parameters[n][1:])))]
+        best = None
+        for order in candidates:
+            names = self.outer+list(order)
+            changeover = self._times(names, self._sequence(names, random.Random(self.seed)))[0]
+            if best is None or changeover < best[0]:
+                best = (changeover, names)
+        self.order = best[1]
+        points = self._sequence(self.order, random.Random(self.seed))
+        return [dict(zip(self.order, point)) for point in points]
+
+    # Method returning the estimated runtime (s) of points, or of the plan
+    def estimate(self, points=None):
+        if points is None:
+            points = self.plan()
+        if not points:
+            return 0
+        names = list(points[0])
+        changeover, acquisition = self._times(names, [tuple(p[n] for n in names) for p in points])
+        return changeover + acquisition
+
+    # Method printing the planned order and runtime next to the naive one
+    # (declared nesting order, no serpentine)
+    def printEstimate(self, points=None):
+        if points is None:
+            points = self.plan()
+        names = list(points[0])
+        changeover, acquisition = self._times(names, [tuple(p[n] for n in names) for p in points])
+        declared = self.outer+[n for n in self.parameters if n not in self.outer]
+        naive = itertools.product(*[self.parameters[n] for n in declared])
+        naive_changeover = self._times(declared, naive)[0]
+        print("Planned "+str(len(points))+" points, loop order: "+" > ".join(names))
+        print("Changeover:  "+_hms(changeover)+" (declared order: "+_hms(naive_changeover)+")")
+        print("Acquisition: "+_hms(acquisition))
+        print("Estimated runtime: "+_hms(changeover + acquisition))
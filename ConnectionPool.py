@@ -0,0 +1,202 @@
+"""
+Shared VISA resource manager and connection pool
+One pyvisa ResourceManager is created per process, on first need, and every
+driver pointing at the same address shares one session, opened lazily on
+its first use with the pool timeout and chunk size
+A session failing with an I/O error is reopened, the functions of
+reconnect_hooks are called with it (InstrumentControl replays the shadowed
+settings) and idempotent commands are retried
+The functions of write_hooks are called with the session and the command
+after every write (InstrumentControl forgets the shadowed settings on *RST)
+
+Example:
+    iqs600 = ConnectionPool.pool.resource("GPIB0::12::INSTR")
+    print(ConnectionPool.pool.stats())
+"""
+# Import library for the pool lock
+import threading
+# Import libraries for the per-command tracing
+import time
+from Tracing import tracer
+
+# Commands changing the instrument state beyond a setting, or reading and
+# clearing a register, which must not be sent twice
+NON_IDEMPOTENT = ("INIT", "*RST", "*CLS", "*TRG", "MMEM", ":EVEN", "CALIB", "ABOR")
+
+# Function telling whether cmd can be sent again after a failure
+def idempotent(cmd):
+    cmd = cmd.upper()
+    return not any(word in cmd for word in NON_IDEMPOTENT)
+
+# Functions called with a session (or LTB transport) after it reconnected
+reconnect_hooks = []
+# Functions called with a session and the command after each write
+write_hooks = []
+
+# Function telling whether an exception is a connection or I/O failure
+def isIOError(e):
+    if isinstance(e, OSError):
+        return True
+    import pyvisa
+    return isinstance(e, pyvisa.errors.VisaIOError)
+
+# Session proxy opening the VISA session on first attribute access
+class LazyResource:
+    def __init__(self, pool, address, timeout, chunk_size):
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "address", address)
+        object.__setattr__(self, "_settings", {"timeout": timeout, "chunk_size": chunk_size})
+        object.__setattr__(self, "_resource", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+        object.__setattr__(self, "reconnects", 0) # reconnections of this session
+
+    # Method returning the underlying session, opening it if needed
+    def open(self):
+        if self._resource is None:
+            with self._lock:
+                if self._resource is None:
+                    resource = self._pool.resource_manager.open_resource(self.address)
+                    for name, value in self._settings.items():
+                        setattr(resource, name, value)
+                    object.__setattr__(self, "_resource", resource)
+                    self._pool._opened += 1
+        return self._resource
+
+    @property
+    def is_open(self):
+        return self._resource is not None
+
+    def close(self):
+        if self._resource is not None:
+            self._resource.close()
+            object.__setattr__(self, "_resource", None)
+
+    # Method closing and reopening the session, then calling the reconnect hooks
+    def reconnect(self):
+        start = time.perf_counter()
+        try:
+            self.close()
+        except Exception:
+            object.__setattr__(self, "_resource", None)
+        self.open()
+        object.__setattr__(self, "reconnects", self.reconnects + 1)
+        self._pool._reconnects += 1
+        for hook in reconnect_hooks:
+            hook(self)
+        if tracer.enabled:
+            tracer.record("wait", self.address, "reconnect", start, time.perf_counter() - start)
+
+    # Method calling a session method, reconnecting on I/O errors and
+    # retrying up to the pool retries when cmd is idempotent
+    def _call(self, method, cmd, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return getattr(self.open(), method)(cmd, *args, **kwargs)
+            except Exception as e:
+                if not isIOError(e) or attempt >= self._pool.retries:
+                    raise
+                self.reconnect()
+                if not idempotent(cmd):
+                    raise
+                attempt += 1
+
+    # I/O methods are traced when the tracer is enabled
+    def write(self, cmd, *args, **kwargs):
+        if not tracer.enabled:
+            result = self._call("write", cmd, *args, **kwargs)
+        else:
+            start = time.perf_counter()
+            result = self._call("write", cmd, *args, **kwargs)
+            tracer.record("write", self.address, cmd, start, time.perf_counter() - start, len(cmd))
+        for hook in write_hooks:
+            hook(self, cmd)
+        return result
+
+    def query(self, cmd, *args, **kwargs):
+        if not tracer.enabled:
+            return self._call("query", cmd, *args, **kwargs)
+        start = time.perf_counter()
+        reply = self._call("query", cmd, *args, **kwargs)
+        tracer.record("query", self.address, cmd, start, time.perf_counter() - start, len(cmd)+len(reply))
+        return reply
+
+    def read_bytes(self, count, *args, **kwargs):
+        if not tracer.enabled:
+            return self.open().read_bytes(count, *args, **kwargs)
+        start = time.perf_counter()
+        data = self.open().read_bytes(count, *args, **kwargs)
+        tracer.record("read", self.address, "read_bytes", start, time.perf_counter() - start, len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.open(), name)
+
+    def __setattr__(self, name, value):
+        if self._resource is None and name in self._settings:
+            self._settings[name] = value
+        else:
+            setattr(self.open(), name, value)
+
+    def __repr__(self):
+        return "<LazyResource "+self.address+(" open>" if self.is_open else " closed>")
+
+class ConnectionPool:
+    # backend is passed to pyvisa.ResourceManager ("" for the default, or
+    # PYVISA_LIBRARY), timeout (ms) and chunk_size (bytes) apply to every
+    # session unless overridden in resource(), retries is the number of
+    # reconnections attempted for one command
+    def __init__(self, backend="", timeout=10000, chunk_size=1024*1024, retries=3):
+        self.backend = backend
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self._rm = None
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._hits = 0
+        self._opened = 0
+        self._reconnects = 0
+
+    @property
+    def resource_manager(self):
+        if self._rm is None:
+            with self._lock:
+                if self._rm is None:
+                    import pyvisa
+                    self._rm = pyvisa.ResourceManager(self.backend)
+        return self._rm
+
+    # Method returning the shared session of address, nothing is opened
+    # until the session is used
+    def resource(self, address, timeout=None, chunk_size=None):
+        with self._lock:
+            self._requests += 1
+            session = self._sessions.get(address)
+            if session is None:
+                session = LazyResource(self, address, timeout or self.timeout, chunk_size or self.chunk_size)
+                self._sessions[address] = session
+            else:
+                self._hits += 1
+            return session
+
+    def stats(self):
+        return {"requests": self._requests,
+                "reused": self._hits,
+                "sessions": len(self._sessions),
+                "opened": self._opened,
+                "reconnects": self._reconnects,
+                "open": sum(s.is_open for s in self._sessions.values())}
+
+    def closeAll(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            if self._rm is not None:
+                self._rm.close()
+                self._rm = None
+
+# Process wide pool used by the InstrumentControl drivers
+pool = ConnectionPool()
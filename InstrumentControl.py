@@ -3,18 +3,60 @@
 Library to perform automation on various instruments, EXFO and others
 Thomas Lacasse 
 Created: 2024-02-16
+
+Drivers are listed in the DRIVERS registry and opened by name through
+openInstrument(), pyvisa, NumPy and the calibration/result modules are only
+imported when a driver first uses them, so TCP only scripts start fast
+
+Example:
+    osa = InstrumentControl.openInstrument("LTB8:LINS5/OSA")
+    yoko = InstrumentControl.openInstrument("GPIB0::16/Yokogawa", srq=True)
 """
 # Import library for TCP/IP handling
 import socket
-# Import library for GPIB/Serial/USB handling
-import pyvisa
+# Import library for the drivers and dependencies imported on demand
+import importlib
+# Import library for the shared VISA sessions
+import ConnectionPool
+# Import library for the per-command latency tracing
+from Tracing import tracer
 # Import library to allow for time pauses
 import time
+# Import library for the platform registry lock
+import threading
+# Import libraries for the LTB transport buffers and batching
+import collections
+import contextlib
+# Import library for the per-platform shadow state registry
+import weakref
+# Import libraries for the capability cache file
+import json
+import os
+import tempfile
 # Import library for path / \\ null character handling
 from pathlib import Path
-# Import library for speed of light
-from scipy import constants
-import numpy as np
+
+# Module proxy importing the module on its first attribute access
+class _LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# Import library for GPIB/Serial/USB handling
+pyvisa = _LazyModule("pyvisa")
+np = _LazyModule("numpy")
+# Import library for the OSA wavelength correction models
+Calibration = _LazyModule("Calibration")
+# Import library for the OSA results streamed to disk
+ResultStore = _LazyModule("ResultStore")
+
+# Speed of light in vacuum (m/s)
+C = 299792458.0
 
 """"
 IQS platform contains :
@@ -28,42 +70,518 @@ LTB platform contains :
     OSA:                LINS14
 """
 
+# Exception raised when a wait is aborted through its cancel event
+class WaitCancelled(Exception):
+    pass
+
+# Function waiting for condition() to become true
+# The poll interval starts at poll_min and grows by the backoff factor up to
+# poll_max, so short operations are caught quickly and long ones (OSA
+# averaging, sweeps) are not flooded with queries
+# cancel is an optional threading.Event set from another thread to abort
+# instrument and label name the wait in the trace, where the time spent
+# between polls is recorded as a "wait" span (the polls are query spans)
+# Returns the measured wait time (s), raises TimeoutError or WaitCancelled
+def waitFor(condition, timeout=None, poll_min=0.01, poll_max=0.5, backoff=1.5, cancel=None, instrument="", label="wait"):
+    start = time.perf_counter()
+    poll = poll_min
+    waited = 0.0
+    try:
+        while not condition():
+            elapsed = time.perf_counter() - start
+            if timeout is not None:
+                if elapsed > timeout:
+                    raise TimeoutError("Condition not met within "+str(timeout)+" s")
+                delay = min(poll, timeout - elapsed)
+            else:
+                delay = poll
+            if cancel is not None:
+                if cancel.wait(delay):
+                    raise WaitCancelled("Wait cancelled after "+str(round(elapsed, 3))+" s")
+            else:
+                time.sleep(delay)
+            waited += delay
+            poll = min(poll*backoff, poll_max)
+    finally:
+        if tracer.enabled:
+            tracer.record("wait", instrument, label, start, waited)
+    return time.perf_counter() - start
+
+# Function polling a readback until it lands within tolerance of a target
+# Returns the observed settle time (s), raises TimeoutError if never reached
+def waitSettle(readback, target, tol, timeout=30, poll=0.05, cancel=None, instrument="", label="settle"):
+    last = [None]
+    def settled():
+        last[0] = readback()
+        return abs(last[0] - target) <= tol
+    try:
+        return waitFor(settled, timeout, poll, 10*poll, cancel=cancel, instrument=instrument, label=label)
+    except TimeoutError:
+        raise TimeoutError("Readback "+str(last[0])+" did not settle to "+str(target)+" within "+str(timeout)+" s")
+
+# Function starting an acquisition with start() and waiting for it with
+# wait(), started again up to restarts times when the link to platform was
+# reopened in the meantime: the acquisition is lost with the connection and
+# the status polled after the reconnect describes an idle instrument, not a
+# completed measurement
+# I/O errors raised after the link was reopened (commands that cannot be
+# retried, such as INIT or event register reads, are not sent again by the
+# transport) also restart the acquisition on the reopened link
+# Returns the result of wait(), raises ConnectionError if every attempt was
+# interrupted
+def acquire(platform, start, wait, label="acquisition", restarts=1):
+    for attempt in range(restarts + 1):
+        reconnects = getattr(platform, "reconnects", 0)
+        try:
+            start()
+            result = wait()
+        except Exception as e:
+            if getattr(platform, "reconnects", 0) == reconnects or not ConnectionPool.isIOError(e):
+                raise
+        else:
+            if getattr(platform, "reconnects", 0) == reconnects:
+                return result
+        print(label+" interrupted by a reconnection, "+("restarting it" if attempt < restarts else "giving up"))
+    raise ConnectionError(label+" interrupted by a reconnection "+str(restarts + 1)+" times")
+
+# Last confirmed value of every setting of the modules behind one platform
+# (GPIB session or LTB transport), shared by all the drivers using it
+# Writes that would not change a setting are skipped; with verify=True a
+# skipped write is first confirmed against the instrument readback when
+# the driver provides one
+class ShadowState:
+    def __init__(self):
+        self.values = {}
+        self.commands = {} # (module, setting) -> last command, for replay()
+        self.verify = False
+        self.skipped = 0
+
+    # Method sending cmd unless module already holds value for setting
+    # confirm is an optional callable returning True when the instrument
+    # really holds value, used in verify mode
+    # Returns True when cmd was sent
+    def write(self, platform, module, setting, value, cmd, confirm=None):
+        key = (module, setting)
+        if key in self.values and self.values[key] == value:
+            if not (self.verify and confirm is not None) or confirm():
+                self.skipped += 1
+                return False
+        platform.write(cmd)
+        self.values[key] = value
+        self.commands[key] = cmd
+        return True
+
+    # Method recording a value written outside of write(), with the command
+    # that set it when it should be replayed after a reconnection
+    def record(self, module, setting, value, cmd=None):
+        self.values[(module, setting)] = value
+        if cmd is not None:
+            self.commands[(module, setting)] = cmd
+
+    # Method sending again every known setting, in the order they were set
+    # Returns the number of commands sent
+    def replay(self, platform):
+        commands = list(self.commands.values())
+        for cmd in commands:
+            platform.write(cmd)
+        return len(commands)
+
+    # Method forgetting the settings of one module, or of every module
+    # Called on *RST and reconnection, when the instrument state is unknown
+    def invalidate(self, module=None):
+        if module is None:
+            self.values.clear()
+            self.commands.clear()
+        else:
+            for key in [k for k in self.values if k[0] == module]:
+                del self.values[key]
+                self.commands.pop(key, None)
+
+_shadows = weakref.WeakKeyDictionary()
+
+# Function returning the shadow state of a platform
+def shadowFor(platform):
+    shadow = _shadows.get(platform)
+    if shadow is None:
+        shadow = _shadows[platform] = ShadowState()
+    return shadow
+
+# Reopened VISA sessions get their shadowed settings back
+ConnectionPool.reconnect_hooks.append(lambda platform: shadowFor(platform).replay(platform))
+
+# Function forgetting the shadowed settings of a VISA session reset by a
+# *RST, whichever code sent it
+def _invalidateOnReset(platform, cmd):
+    if "*RST" in cmd.upper():
+        shadowFor(platform).invalidate()
+
+ConnectionPool.write_hooks.append(_invalidateOnReset)
+
+# Persistent cache of module capabilities (attenuation, wavelength and
+# power limits, channel count), which never change for a given module
+# Entries are keyed by module serial number and slot and expire after
+# expiry seconds; the cache is a JSON file replaced atomically on update
+# Threads share the entries under a lock; each update merges the entries
+# written meanwhile by other processes and goes through a temporary file
+# of its own
+class CapabilityCache:
+    def __init__(self, path=None, expiry=30*24*3600):
+        self.path = Path(path) if path else Path.home() / ".exfo_automation" / "capabilities.json"
+        self.expiry = expiry
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._read()
+            return self._entries
+
+    # Method returning the cached capabilities of key, None when missing,
+    # expired or when refresh is forced
+    def get(self, key, refresh=False):
+        entry = self._load().get(key)
+        if refresh or entry is None or time.time() - entry["t"] > self.expiry:
+            return None
+        return entry["caps"]
+
+    def put(self, key, caps):
+        with self._lock:
+            entries = self._read()
+            for name, entry in (self._entries or {}).items():
+                if name not in entries or entries[name]["t"] < entry["t"]:
+                    entries[name] = entry
+            entries[key] = {"t": time.time(), "caps": caps}
+            self._entries = entries
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=self.path.name+".", suffix=".tmp", dir=self.path.parent)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(entries, f, indent=1)
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            if self.path.exists():
+                self.path.unlink()
+
+capability_cache = CapabilityCache()
+
+# Function sending several queries, pipelined when the platform supports it
+def _queryAll(platform, cmds):
+    if hasattr(platform, "queryMany"):
+        return platform.queryMany(cmds)
+    return [platform.query(cmd) for cmd in cmds]
+
+# Function returning the capabilities of the module behind prefix (LINSx)
+# from the cache, or from queries(name -> SCPI query) on a miss
+def _capabilities(platform, prefix, queries, refresh=False):
+    key = platform.query(prefix+":SNUM?").strip().strip('"')+"@"+prefix
+    caps = capability_cache.get(key, refresh)
+    if caps is None:
+        replies = _queryAll(platform, [prefix+":"+q for q in queries.values()])
+        caps = dict(zip(queries, [_toFloat(r) for r in replies]))
+        capability_cache.put(key, caps)
+    return caps
+
 # IQS platform class definition
 class IQS:
     def __init__(self,  GPIB0, interface=0):
-        rm = pyvisa.ResourceManager()
-        self.platform = rm.open_resource("GPIB"+str(interface)+"::"+str(GPIB0)+"::INSTR")
+        self.platform = ConnectionPool.pool.resource("GPIB"+str(interface)+"::"+str(GPIB0)+"::INSTR")
         print("Connexion established with: "+ self.platform.query("*IDN?"))
 
 # MPC-201 polarization scrambler form LUNA (General Photonics) class defintion
 class MPC_201:
     def __init__(self, GPIB0, interface=0):
-        rm = pyvisa.ResourceManager()
         self.type = "DISC"
         self.speed = 0
-        self.platform = rm.open_resource("GPIB"+str(interface)+"::"+str(GPIB0)+"::INSTR")
+        self.platform = ConnectionPool.pool.resource("GPIB"+str(interface)+"::"+str(GPIB0)+"::INSTR")
         print("Connexion established with: "+ self.platform.query("*IDN?"))
-        self.platform.write("INP:SCR:"+self.type+":RATE "+str(self.speed))
+        self.setRate(self.speed)
+
+    # Writes skipped when the scrambling mode and rate are unchanged
+    def _setScrambling(self):
+        shadowFor(self.platform).write(self.platform, "", "scrambling", (self.type, self.speed),
+                                       "INP:SCR:"+self.type+":RATE "+str(self.speed))
 
     def setDisc(self):
         self.type = "DISC"
-        self.platform.write("INP:SCR:DISC:RATE 0")
+        self.speed = 0
+        self._setScrambling()
 
     def setTri(self):
         self.type = "TRI"
-        self.platform.write("INP:SCR:TRI:RATE 0")
+        self.speed = 0
+        self._setScrambling()
 
     def setRate(self, rate):
         self.speed = rate
-        self.platform.write("INP:SCR:"+self.type+":RATE "+str(self.speed))
+        self._setScrambling()
+
+    def reset(self):
+        self.platform.write("*RST")
+
+# Function converting a numerical SCPI reply to float, the LTB modules may
+# wrap the value in quotes or brackets
+def _toFloat(reply):
+    return float(reply.strip().strip('"[]'))
+
+# Newline framed SCPI transport over the LTB socket
+# 1. Replies are read line by line from a persistent buffer, so a reply split
+#    across TCP segments or merged with the next one is framed correctly
+# 2. Writes issued inside "with transport.batch():" leave in a single sendall
+# 3. Queries can be pipelined, sendQuery() returns a ticket and reply(ticket)
+#    collects the answers in order
+# 4. queryBlock() reads IEEE 488.2 definite length binary blocks (traces)
+# 5. A dropped connection is reopened, the shadowed settings are replayed
+#    and idempotent commands and queries retried, up to retries times
+# sendall()/recv() are kept so code written for the raw socket still works
+class LTBTransport:
+    def __init__(self, sock, terminator="\n", encoding="utf-8", retries=3):
+        self.sock = sock
+        self.terminator = terminator.encode()
+        self.encoding = encoding
+        self.retries = retries
+        self.reconnects = 0
+        self._rbuf = bytearray()
+        self._wbuf = []
+        self._batching = 0
+        self._sent = 0 # number of queries sent
+        self._received = 0 # number of replies read from the socket
+        self._replies = {} # ticket -> reply read ahead of its turn
+        self._legacy = collections.deque() # tickets of queries sent through sendall()
+        self._quiet = 0 # > 0 while a query span covers the inner write/read
+        try:
+            self.address = sock.getpeername()[:2]
+            self.name = "LTB %s:%d" % self.address
+        except OSError:
+            self.address = None
+            self.name = "LTB"
+
+    # Method opening a new connection to the LTB, dropping the commands and
+    # replies in flight, then replaying the shadowed settings
+    def reconnect(self):
+        if self.address is None:
+            raise ConnectionError("LTB address unknown, cannot reconnect")
+        start = time.perf_counter()
+        timeout = self.sock.gettimeout()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        delay = 0.5
+        for attempt in range(self.retries + 1):
+            try:
+                sock = socket.create_connection(self.address, timeout)
+                break
+            except OSError:
+                if attempt == self.retries:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self._rbuf = bytearray()
+        self._wbuf = []
+        self._received = self._sent
+        self._replies = {}
+        self._legacy.clear()
+        self.reconnects += 1
+        with self.batch():
+            replayed = shadowFor(self).replay(self)
+        if tracer.enabled:
+            tracer.record("wait", self.name, "reconnect ("+str(replayed)+" replayed)", start, time.perf_counter() - start)
+
+    # Method calling func(cmd), reconnecting on connection errors and retrying
+    # when cmd is idempotent
+    def _retry(self, func, cmd):
+        attempt = 0
+        while True:
+            try:
+                return func(cmd)
+            except OSError:
+                if self.address is None or attempt >= self.retries:
+                    raise
+                self.reconnect()
+                if not ConnectionPool.idempotent(cmd):
+                    raise
+                attempt += 1
+
+    # Method queueing a command, sent immediately unless batching
+    def write(self, cmd):
+        if "*RST" in cmd:
+            shadowFor(self).invalidate()
+        self._wbuf.append(cmd.encode(self.encoding)+self.terminator)
+        if not self._batching:
+            self.flush()
+
+    # Method sending every queued command in one packet
+    def flush(self):
+        if self._wbuf:
+            data = b"".join(self._wbuf)
+            count = len(self._wbuf)
+            self._wbuf = []
+            start = time.perf_counter()
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                # Writes are sent again on a new connection when every one
+                # may be, packets holding queries are left to the query retry
+                if self.address is None or b"?" in data or not ConnectionPool.idempotent(data.decode(self.encoding)):
+                    raise
+                self.reconnect()
+                self.sock.sendall(data)
+            if tracer.enabled and not self._quiet:
+                label = data.split(self.terminator, 1)[0].decode(self.encoding)
+                if count > 1:
+                    label += " (+"+str(count-1)+")"
+                tracer.record("write", self.name, label, start, time.perf_counter() - start, len(data))
+
+    # Context manager grouping consecutive writes into one packet
+    @contextlib.contextmanager
+    def batch(self):
+        self._batching += 1
+        try:
+            yield self
+        finally:
+            self._batching -= 1
+            if not self._batching:
+                self.flush()
+
+    # Method reading one framed reply from the socket
+    def _readLine(self):
+        while True:
+            idx = self._rbuf.find(self.terminator)
+            if idx >= 0:
+                line = bytes(self._rbuf[:idx])
+                del self._rbuf[:idx+len(self.terminator)]
+                return line.decode(self.encoding).rstrip("\r")
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("LTB closed the connection")
+            self._rbuf += chunk
+
+    # Method reading exactly n bytes from the socket
+    def _readBytes(self, n):
+        while len(self._rbuf) < n:
+            chunk = self.sock.recv(max(65536, n - len(self._rbuf)))
+            if not chunk:
+                raise ConnectionError("LTB closed the connection")
+            self._rbuf += chunk
+        data = bytes(self._rbuf[:n])
+        del self._rbuf[:n]
+        return data
+
+    # Method sending a query answered by a binary block (#<n><length><data>)
+    # and returning the data bytes
+    # Replies of queries still pipelined are read ahead first, so the block
+    # is the next thing on the socket
+    def queryBlock(self, cmd):
+        return self._retry(self._queryBlock, cmd)
+
+    def _queryBlock(self, cmd):
+        start = time.perf_counter()
+        self.flush()
+        while self._received < self._sent:
+            self._replies[self._received] = self._readLine()
+            self._received += 1
+        self._quiet += 1
+        try:
+            self.write(cmd)
+        finally:
+            self._quiet -= 1
+        head = self._readBytes(2)
+        if head[:1] != b"#":
+            raise ValueError("Expected a binary block, got "+repr(head+self._readLine().encode(self.encoding)))
+        nbytes = int(self._readBytes(int(head[1:2])))
+        data = self._readBytes(nbytes)
+        # Block is followed by the message terminator
+        self._readLine()
+        if tracer.enabled:
+            tracer.record("query", self.name, cmd, start, time.perf_counter() - start, len(cmd)+len(data))
+        return data
+
+    # Method sending a query without waiting for its reply, returns a ticket
+    def sendQuery(self, cmd):
+        self.write(cmd)
+        ticket = self._sent
+        self._sent += 1
+        return ticket
+
+    # Method returning the reply matching a ticket from sendQuery()
+    def reply(self, ticket):
+        self.flush()
+        start = time.perf_counter()
+        while ticket not in self._replies:
+            if self._received >= self._sent:
+                raise ValueError("No query outstanding for ticket "+str(ticket))
+            self._replies[self._received] = self._readLine()
+            self._received += 1
+        reply = self._replies.pop(ticket)
+        if tracer.enabled and not self._quiet:
+            tracer.record("read", self.name, "reply", start, time.perf_counter() - start, len(reply))
+        return reply
+
+    # Method sending a query and returning its reply
+    def query(self, cmd):
+        return self._retry(self._query, cmd)
+
+    def _query(self, cmd):
+        if not tracer.enabled:
+            return self.reply(self.sendQuery(cmd))
+        start = time.perf_counter()
+        self._quiet += 1
+        try:
+            reply = self.reply(self.sendQuery(cmd))
+        finally:
+            self._quiet -= 1
+        tracer.record("query", self.name, cmd, start, time.perf_counter() - start, len(cmd)+len(reply))
+        return reply
+
+    # Method sending several queries in one packet and returning the replies in order
+    def queryMany(self, cmds):
+        with self.batch():
+            tickets = [self.sendQuery(cmd) for cmd in cmds]
+        return [self.reply(t) for t in tickets]
+
+    # Raw socket compatible write, every line containing "?" counts as a query
+    def sendall(self, data):
+        for line in data.decode(self.encoding).splitlines():
+            if "?" in line:
+                self._legacy.append(self.sendQuery(line))
+            elif line:
+                self.write(line)
+
+    # Raw socket compatible read, returns the next reply of a sendall() query
+    def recv(self, bufsize=4096):
+        return (self.reply(self._legacy.popleft())+"\n").encode(self.encoding)
+
+    def close(self):
+        self.flush()
+        self.sock.close()
 
 # LTB platform class definition
+# timeout (s) bounds every socket operation, a dead link raises instead of
+# hanging and is handled by the transport reconnection
 class LTB:
-    def __init__(self, add, port):
-        self.platform = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.platform.connect((str(add), port))
-        self.platform.sendall("*IDN?\n".encode())
-        print("Connexion established with: "+ self.platform.recv(4096).decode("utf8"))
+    def __init__(self, add, port, timeout=30, retries=3):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect((str(add), port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.platform = LTBTransport(sock, retries=retries)
+        print("Connexion established with: "+ self.platform.query("*IDN?"))
 
 # Class establishing VOA status and operations
 # 1. Set attenuation
@@ -72,36 +590,62 @@ class VOA:
     # Class initialization, acquires maximum and minimum
     # attenuation values, sets the attenuation to the minimum
     # and opens the shutter
-    def __init__(self, platform_name1,  platform_obj1, lins_no): #Set iqs platform as an object to pass into every class
+    # settle=True replaces the fixed 2 s pause with an attenuation readback
+    # poll, the observed settle time is kept in self.settle_time
+    # Limits come from the capability cache, refresh=True queries them again
+    def __init__(self, platform_name1,  platform_obj1, lins_no, settle=False, refresh=False): #Set iqs platform as an object to pass into every class
         print("Initializing VOA")
         self.units = "DB"
+        self.settle = settle
+        self.att_tol = 0.05 # in dB
+        self.settle_timeout = 10 # in s
+        self.settle_time = None
         self.lins = lins_no
         self.platform_name = platform_name1
         self.platform_obj = platform_obj1
         if self.platform_name == "IQS600":
-            self.min_att = float(self.platform_obj.query("LINS001"+str(self.lins)+":INP:ATT? MIN"))
-            self.max_att = float(self.platform_obj.query("LINS001"+str(self.lins)+":INP:ATT? MAX"))
-            self.platform_obj.write("LINS001"+str(self.lins)+":OUTP:STAT 1")
-            self.platform_obj.write("LINS001"+str(self.lins)+":INP:ATT "+str(self.min_att)+" "+self.units)
+            self.module = "LINS001"+str(self.lins)
         elif self.platform_name == "LTB8":
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":INP:ATT? MIN\n").encode())
-            self.min_att = float(self.platform_obj.recv(4096).decode("utf-8"))
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":INP:ATT? MAX\n").encode())
-            self.max_att = float(self.platform_obj.recv(4096).decode("utf-8"))
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":OUTP:STAT 1\n").encode())
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":INP:ATT "+str(self.min_att)+" "+self.units+"\n").encode())
+            self.module = "LINS"+str(self.lins)
+        caps = _capabilities(self.platform_obj, self.module, {"min_att": "INP:ATT? MIN", "max_att": "INP:ATT? MAX"}, refresh)
+        self.min_att = caps["min_att"]
+        self.max_att = caps["max_att"]
+        if self.platform_name == "IQS600":
+            self.platform_obj.write(self.module+":OUTP:STAT 1")
+            self.platform_obj.write(self.module+":INP:ATT "+str(self.min_att)+" "+self.units)
+        elif self.platform_name == "LTB8":
+            with self.platform_obj.batch():
+                self.platform_obj.write(self.module+":OUTP:STAT 1")
+                self.platform_obj.write(self.module+":INP:ATT "+str(self.min_att)+" "+self.units)
+        shadowFor(self.platform_obj).record(self.module, "att", self.min_att,
+                                            self.module+":INP:ATT "+str(self.min_att)+" "+self.units)
         self.att = self.min_att
         self.shut = "Opened"
-        time.sleep(2)
+        if self.settle:
+            self.waitSettled()
+        else:
+            tracer.sleep(2, self.module, "VOA init pause")
         print("VOA "+str(self.lins)+" initialized successfully")
+
+    # Method reading back the current attenuation of the VOA
+    def getAtt(self):
+        if self.platform_name == "IQS600":
+            return float(self.platform_obj.query("LINS001"+str(self.lins)+":INP:ATT?"))
+        elif self.platform_name == "LTB8":
+            return _toFloat(self.platform_obj.query("LINS"+str(self.lins)+":INP:ATT?"))
+
+    # Method waiting until the attenuation readback reaches the setpoint
+    def waitSettled(self):
+        self.settle_time = waitSettle(self.getAtt, self.att, self.att_tol, self.settle_timeout,
+                                      instrument=self.module, label="VOA settle")
+        return self.settle_time
     
-    # Method setting the attenuation of the VOA
+    # Method setting the attenuation of the VOA, skipped when unchanged
     def setAtt(self,  attenuation):
         self.att = attenuation
-        if self.platform_name == "IQS600":
-            self.platform_obj.write("LINS001"+str(self.lins)+":INP:ATT "+str(self.att)+" "+self.units)
-        elif self.platform_name == "LTB8":
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":INP:ATT "+str(self.att)+" "+self.units+"\n").encode())
+        shadowFor(self.platform_obj).write(self.platform_obj, self.module, "att", self.att,
+                                           self.module+":INP:ATT "+str(self.att)+" "+self.units,
+                                           lambda: abs(self.getAtt() - attenuation) <= self.att_tol)
 
     # Method opening the shutter
     def openShut(self):
@@ -109,7 +653,7 @@ class VOA:
             if self.platform_name == "IQS600":
                 self.platform_obj.write("LINS001"+str(self.lins)+":OUTP:STAT 1")
             elif self.platform_name == "LTB8":
-                self.platform_obj.sendall(("LINS"+str(self.lins)+":OUTP:STAT 1\n").encode())
+                self.platform_obj.write("LINS"+str(self.lins)+":OUTP:STAT 1")
             self.shut = "Opened"
 
     # Method closing the shutter
@@ -118,68 +662,289 @@ class VOA:
             if self.platform_name == "IQS600":
                 self.platform_obj.write("LINS001"+str(self.lins)+":OUTP:STAT 0")
             elif self.platform_name == "LTB8":
-                self.platform_obj.sendall(("LINS"+str(self.lins)+":OUTP:STAT 0\n").encode())
+                self.platform_obj.write("LINS"+str(self.lins)+":OUTP:STAT 0")
             self.shut = "Closed"
 
+# Class setting several VOAs together, on one or several chassis
+# 1. Each step writes the changed attenuations of a chassis in one bus
+#    transaction (LTB packet, or one ";:" compound command over GPIB)
+# 2. The settle wait covers every VOA at once, it lasts as long as the
+#    slowest one instead of the sum of them
+# 3. OSNR grids: the attenuations giving each target OSNR, from one
+#    reference measurement kept for the group (optionally on disk)
+# voas maps a name to each VOA; with settle=False every step ends with the
+# fixed 2 s VOA pause, taken once per step
+#
+# Example:
+#     group = VOAGroup({"sig": voa_sig, "ase": voa_ase, "scr": voa_scr}, settle=True)
+#     group.ramp({"sig": [0, 1, 2], "ase": [10, 8, 6]}, lambda i, step: osa.inband_Analysis(...))
+class VOAGroup:
+    def __init__(self, voas, settle=True):
+        self.voas = voas
+        self.settle = settle
+        self.settle_time = None
+        self.references = {} # OSNR references measured by osnrGrid()
+
+    # Method sending the attenuations of targets (name -> dB), one
+    # transaction per chassis, then waiting for every VOA to settle
+    # Returns the settle time (s)
+    def set(self, targets):
+        chassis = {}
+        for name, att in targets.items():
+            voa = self.voas[name]
+            chassis.setdefault(id(voa.platform_obj), []).append((voa, att))
+        for voas in chassis.values():
+            platform = voas[0][0].platform_obj
+            shadow = shadowFor(platform)
+            cmds = []
+            for voa, att in voas:
+                voa.att = att
+                if shadow.values.get((voa.module, "att")) != att:
+                    cmd = voa.module+":INP:ATT "+str(att)+" "+voa.units
+                    cmds.append(cmd)
+                    shadow.record(voa.module, "att", att, cmd)
+            if not cmds:
+                continue
+            if isinstance(platform, LTBTransport):
+                with platform.batch():
+                    for cmd in cmds:
+                        platform.write(cmd)
+            else:
+                platform.write(";:".join(cmds))
+        start = time.perf_counter()
+        if self.settle:
+            pending = [self.voas[name] for name in targets]
+            def settled():
+                atts = self._readAll(pending)
+                pending[:] = [voa for voa, att in zip(pending, atts) if abs(att - voa.att) > voa.att_tol]
+                return not pending
+            waitFor(settled, max(voa.settle_timeout for voa in self.voas.values()), poll_min=0.02,
+                    instrument="VOAGroup", label="VOA group settle")
+        else:
+            tracer.sleep(2, "VOAGroup", "VOA group pause")
+        self.settle_time = time.perf_counter() - start
+        return self.settle_time
+
+    # Method reading back the attenuation of voas, the reads of an LTB
+    # chassis are pipelined
+    def _readAll(self, voas):
+        atts = {}
+        chassis = {}
+        for voa in voas:
+            if isinstance(voa.platform_obj, LTBTransport):
+                chassis.setdefault(id(voa.platform_obj), []).append(voa)
+            else:
+                atts[id(voa)] = voa.getAtt()
+        for group in chassis.values():
+            replies = group[0].platform_obj.queryMany([voa.module+":INP:ATT?" for voa in group])
+            for voa, reply in zip(group, replies):
+                atts[id(voa)] = _toFloat(reply)
+        return [atts[id(voa)] for voa in voas]
+
+    # Method running a ramp, steps is a dict of target vectors (name -> list
+    # of dB, all the same length) or a list of {name: dB} steps
+    # measure(i, step), optional, runs once every VOA of step i has settled
+    # Returns the list of the measure() results
+    def ramp(self, steps, measure=None):
+        if isinstance(steps, dict):
+            names = list(steps)
+            steps = [dict(zip(names, values)) for values in zip(*steps.values())]
+        results = []
+        for i, step in enumerate(steps):
+            self.set(step)
+            if measure is not None:
+                results.append(measure(i, step))
+        return results
+
+    # Method returning the {signal: dB, ase: dB} step of each target OSNR (dB)
+    # The OSNR follows the ASE minus signal attenuation one to one, so
+    # measure() (returning the OSNR) is only called once, at signal_att and
+    # ase_att, and that reference is kept in self.references for the life of
+    # the group (refresh=True measures it again); the signal VOA only moves
+    # from signal_att when the ASE VOA range alone cannot reach a target
+    # The reference depends on the whole setup (source power, amplifiers,
+    # filters, wavelength), so it is only reused across runs on request:
+    # path is a JSON file where references are saved by VOA module and
+    # serial and by setup, a caller-supplied description of the rest of the
+    # setup (required with path), and reused for expiry seconds
+    def osnrGrid(self, osnrs, measure, signal="sig", ase="ase", signal_att=0, ase_att=None, path=None, setup=None,
+                 expiry=3600, refresh=False):
+        sig = self.voas[signal]
+        noise = self.voas[ase]
+        if ase_att is None:
+            ase_att = noise.min_att
+        if path is not None and setup is None:
+            raise ValueError("A setup description is required to reuse OSNR references from "+str(path))
+        key = "/".join(voa.platform_obj.query(voa.module+":SNUM?").strip().strip('"')+"@"+voa.module
+                       for voa in (sig, noise))+" "+str(signal_att)+"/"+str(ase_att)+" DB "+str(setup)
+        cache = {}
+        if path is not None:
+            path = Path(path)
+            try:
+                cache = json.loads(path.read_text())
+            except (OSError, ValueError):
+                cache = {}
+            entry = cache.get(key)
+            if entry is not None and time.time() - entry["t"] <= expiry and key not in self.references:
+                self.references[key] = entry["osnr"]
+        if refresh or key not in self.references:
+            self.set({signal: signal_att, ase: ase_att})
+            self.references[key] = float(measure())
+            if path is not None:
+                cache[key] = {"t": time.time(), "osnr": self.references[key]}
+                path.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(prefix=path.name+".", suffix=".tmp", dir=path.parent)
+                with os.fdopen(fd, "w") as f:
+                    json.dump(cache, f, indent=1)
+                os.replace(tmp, path)
+        reference = self.references[key]
+        grid = []
+        for osnr in osnrs:
+            # ase - sig must change by the OSNR difference
+            delta = osnr - reference + (ase_att - signal_att)
+            a_att = min(max(signal_att + delta, noise.min_att), noise.max_att)
+            s_att = min(max(a_att - delta, sig.min_att), sig.max_att)
+            grid.append({signal: s_att, ase: a_att})
+        return grid
+
 # Class establishing TLS status and operations
 # 1. Get power and wl min/max
 # 2. Turn on/off the source
 # 3. Set power and wl
 class TLS:
     # Class initialization, acquires maximum and minimum
-    # power and wl values, Turns on the source at maximum power and 1550 nm
-    # Everything done with source 1 out of 4 (See SOUR1 in SCPI commands)
-    def __init__(self, platform_name1, platform_obj1, lins_no):
+    # power and wl values, Turns on source 1 at maximum power and 1550 nm
+    # Every method takes the channel ch (1 to ch_count, SOURn in the SCPI
+    # commands), channel 1 by default; self.ch_wl, self.ch_pow and
+    # self.ch_status hold the setpoints of each channel by number, self.wl,
+    # self.pow and self.status those of channel 1
+    # settle=True replaces the fixed 10 s pauses with readback polling of
+    # wavelength, power and emission state, the observed settle time of the
+    # last operation is kept in self.settle_time
+    # Limits come from the capability cache, refresh=True queries them again
+    def __init__(self, platform_name1, platform_obj1, lins_no, settle=False, refresh=False):
         self.lins = lins_no
         self.platform_name = platform_name1
         self.platform_obj = platform_obj1
         self.units = "DBM"
+        self.settle = settle
+        self.wl_tol = 1e-12 # in m
+        self.pow_tol = 0.05 # in dB
+        self.settle_timeout = 30 # in s
+        self.settle_time = None
         self.wl = 1.55e-6 # in m
+        self.ch_wl = {1: self.wl}
+        self.ch_pow = {}
+        self.ch_status = {}
         if self.platform_name == "LTB8":
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR:POW:WAV? MIN\n").encode())
-            self.min_wl = float(self.platform_obj.recv(4096).decode("utf-8").strip("\n")[1:-1])
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR:POW:WAV? MAX\n").encode())
-            self.max_wl = float(self.platform_obj.recv(4096).decode("utf-8").strip("\n")[1:-1])
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR:POW? MIN\n").encode())
-            self.min_pow = float(self.platform_obj.recv(4096).decode("utf-8").strip("\n")[1:-1])
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR:POW? MAX\n").encode())
-            self.max_pow = float(self.platform_obj.recv(4096).decode("utf-8").strip("\n")[1:-1])
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR1:POW "+ str(self.max_pow) +" "+ self.units+"\n").encode())
-            self.pow = self.max_pow
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR1:POW:STAT 1\n").encode())
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR:COUN?\n").encode())
-            self.ch_count = float(self.platform_obj.recv(4096).decode("utf-8").strip("\n"))
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR1:POW:FREQ "+str(constants.c*10**(-14)/self.wl)+"e+14 HZ\n").encode())
-            self.status = "On"
+            caps = _capabilities(self.platform_obj, "LINS"+str(self.lins),
+                                 {"min_wl": "SOUR:POW:WAV? MIN", "max_wl": "SOUR:POW:WAV? MAX",
+                                  "min_pow": "SOUR:POW? MIN", "max_pow": "SOUR:POW? MAX",
+                                  "ch_count": "SOUR:COUN?"}, refresh)
+            self.min_wl = caps["min_wl"]
+            self.max_wl = caps["max_wl"]
+            self.min_pow = caps["min_pow"]
+            self.max_pow = caps["max_pow"]
+            self.ch_count = int(caps["ch_count"])
+            self._keep("pow", 1, self.max_pow)
+            with self.platform_obj.batch():
+                self.platform_obj.write(self._cmd(1, "POW "+ str(self.max_pow) +" "+ self.units))
+                self.platform_obj.write(self._cmd(1, "POW:STAT 1"))
+                self.platform_obj.write(self._freqCmd(1, self.wl))
+            shadow = shadowFor(self.platform_obj)
+            shadow.record("LINS"+str(self.lins), "pow1", self.pow, self._cmd(1, "POW "+ str(self.max_pow) +" "+ self.units))
+            shadow.record("LINS"+str(self.lins), "wl1", self.wl, self._freqCmd(1, self.wl))
+            self._keep("status", 1, "On")
         print("TLS "+str(self.lins)+" initialized successfully")
 
+    # Method storing the setpoint name (wl, pow or status) of channel ch,
+    # mirrored in the scalar attribute for channel 1
+    def _keep(self, name, ch, value):
+        getattr(self, "ch_"+name)[ch] = value
+        if ch == 1:
+            setattr(self, name, value)
+
+    # Method returning the command cmd addressed to channel ch
+    def _cmd(self, ch, cmd):
+        if not 1 <= ch <= self.ch_count:
+            raise ValueError("TLS "+str(self.lins)+" has channels 1 to "+str(self.ch_count)+", not "+str(ch))
+        return "LINS"+str(self.lins)+":SOUR"+str(ch)+":"+cmd
+
+    def _freqCmd(self, ch, wl):
+        return self._cmd(ch, "POW:FREQ "+str(C*10**(-14)/wl)+"e+14 HZ")
+
+    # Method querying a numerical value of the source
+    def _query(self, cmd):
+        return _toFloat(self.platform_obj.query("LINS"+str(self.lins)+":"+cmd))
+
+    # Method reading back the source wl (m)
+    def getWL(self, ch=1):
+        return C/self._query("SOUR"+str(ch)+":POW:FREQ?")
+
+    # Method reading back the source power (dBm)
+    def getPower(self, ch=1):
+        return self._query("SOUR"+str(ch)+":POW?")
+
+    # Method reading back the emission state (1 on, 0 off)
+    def getState(self, ch=1):
+        return self._query("SOUR"+str(ch)+":POW:STAT?")
+
+    # Method waiting for a readback to reach its target, or for the fixed
+    # pause when the settle mode is off
+    def _settle(self, readback, target, tol):
+        if self.settle and self.platform_name == "LTB8":
+            self.settle_time = waitSettle(readback, target, tol, self.settle_timeout,
+                                          instrument="LINS"+str(self.lins), label="TLS settle")
+        else:
+            tracer.sleep(10, "LINS"+str(self.lins), "TLS pause")
+            self.settle_time = 10
+
     # Method setting the source power
-    def setPower(self, p):
+    def setPower(self, p, ch=1):
         if self.platform_name == "LTB8":
-            self.pow = p
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR1:POW "+str(p)+" DBM\n").encode())
-        time.sleep(10)
+            self._keep("pow", ch, p)
+            shadowFor(self.platform_obj).write(self.platform_obj, "LINS"+str(self.lins), "pow"+str(ch), p,
+                                               self._cmd(ch, "POW "+str(p)+" DBM"),
+                                               lambda: abs(self.getPower(ch) - p) <= self.pow_tol)
+        self._settle(lambda: self.getPower(ch), p, self.pow_tol)
     # Method setting the source wl (m)
-    def setWL(self, wl1):
+    def setWL(self, wl1, ch=1):
+        self.setWLs({ch: wl1})
+    # Method setting the wl (m) of several channels, wls maps channel to wl
+    # The commands leave in one packet and the channels settle together
+    def setWLs(self, wls):
         if self.platform_name == "LTB8":
-            if wl1 != self.wl:
-                self.wl = wl1
-                self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR1:POW:FREQ "+str(constants.c*10**(-14)/self.wl)+"e+14 HZ\n").encode())
-        time.sleep(10)
+            shadow = shadowFor(self.platform_obj)
+            with self.platform_obj.batch():
+                for ch, wl1 in wls.items():
+                    self._keep("wl", ch, wl1)
+                    shadow.write(self.platform_obj, "LINS"+str(self.lins), "wl"+str(ch), wl1, self._freqCmd(ch, wl1),
+                                 lambda ch=ch, wl1=wl1: abs(self.getWL(ch) - wl1) <= self.wl_tol)
+        if self.settle and self.platform_name == "LTB8":
+            start = time.perf_counter()
+            for ch, wl1 in wls.items():
+                self._settle(lambda ch=ch: self.getWL(ch), wl1, self.wl_tol)
+            self.settle_time = time.perf_counter() - start
+        else:
+            self._settle(None, None, None)
     # Method turning off laser emission
-    def turnOff(self):
+    # A channel already off is left alone, without the settle pause
+    def turnOff(self, ch=1):
         if self.platform_name == "LTB8":
-            if self.status == "On":
-                self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR1:POW:STAT 0\n").encode())
-                self.status = "Off"
-        time.sleep(10)
+            if self.ch_status.get(ch) == "Off":
+                return
+            self.platform_obj.write(self._cmd(ch, "POW:STAT 0"))
+            self._keep("status", ch, "Off")
+        self._settle(lambda: self.getState(ch), 0, 0)
     # Method turning on laser emission
-    def turnOn(self):
+    # A channel already on is left alone, without the settle pause
+    def turnOn(self, ch=1):
         if self.platform_name == "LTB8":
-            if self.status == "Off":
-                self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR1:POW:STAT 1\n").encode())
-                self.status = "On"
-        time.sleep(10)
+            if self.ch_status.get(ch) == "On":
+                return
+            self.platform_obj.write(self._cmd(ch, "POW:STAT 1"))
+            self._keep("status", ch, "On")
+        self._settle(lambda: self.getState(ch), 1, 0)
 class DFB:
     # Class initialization, acquires maximum and minimum
     # power and wl values, Turns on the source at maximum power and 1550 nm
@@ -191,15 +956,15 @@ class DFB:
         self.units = "DBM"
         self.status = "On"
         if self.platform_name == "LTB8":
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR1:POW:STAT 1\n").encode())
+            self.platform_obj.write("LINS"+str(self.lins)+":SOUR1:POW:STAT 1")
     
     def turnOn(self):
         self.status = "On"
-        self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR1:POW:STAT 1\n").encode())
+        self.platform_obj.write("LINS"+str(self.lins)+":SOUR1:POW:STAT 1")
 
     def turnOff(self):
             self.status = "Off"
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":SOUR1:POW:STAT 0\n").encode())
+            self.platform_obj.write("LINS"+str(self.lins)+":SOUR1:POW:STAT 0")
 
 # Class establishing OSA status and operations
 # 1. Get power and wl min/max
@@ -212,38 +977,104 @@ class OSA:
         self.platform_obj = platform_obj1
         self.wl_span = [1525e-9, 1565e-9]
         self.nSOP = 300
+        self.sop_time = 0.05 # expected acquisition time per SOP (s)
+        self.acq_time = None
+        self.store = None
+        self.results = None
         print("OSA "+str(self.lins)+" initialized successfully")
 
-    def inband_Analysis(self, wl_range, n_states, filepath):
+    # Method running an in-band acquisition
+    # filepath saves the measurement on the instrument disk (.xosawdm), store
+    # streams the trace and WDM results over the socket into a local
+    # ResultStore instead (a ResultStore or the path of one, created on the
+    # first acquisition and kept in self.store, the record in self.results),
+    # both can be combined
+    # timeout (s) bounds each wait, by default 60 s plus three times the
+    # expected acquisition time (nSOP*sop_time); cancel is an optional
+    # threading.Event
+    # The measured acquisition time is kept in self.acq_time
+    def inband_Analysis(self, wl_range, n_states, filepath=None, timeout=None, cancel=None, store=None):
         self.wl_span = wl_range
         self.nSOP = n_states
-        self.platform_obj.sendall(("LINS"+str(self.lins)+":SENS:CORR:OFFS:MAGN 0.0 DB\n").encode())
-        self.platform_obj.sendall(("LINS"+str(self.lins)+":SENS:WAV:OFFS 0 NM\n").encode())
-        self.platform_obj.sendall(("LINS"+str(self.lins)+":SENS:WAV:STAR "+str(self.wl_span[0])+" M\n").encode())
-        self.platform_obj.sendall(("LINS"+str(self.lins)+":SENS:WAV:STOP "+str(self.wl_span[1])+" M\n").encode())
-        self.platform_obj.sendall(("LINS"+str(self.lins)+":SENS:AVER:STAT ON\n").encode())
-        self.platform_obj.sendall(("LINS"+str(self.lins)+":SENS:AVER:TYPE:PMMH\n").encode())
-        self.platform_obj.sendall(("LINS"+str(self.lins)+":SENS:AVER:COUN "+str(self.nSOP)+"\n").encode())
-        self.platform_obj.sendall(("LINS"+str(self.lins)+":TRIG:SEQ:SOUR IMM\n").encode())
-        while True:
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":STAT?\n").encode())
-            stat = self.platform_obj.recv(4096).decode("utf-8")
-            if "READY" in stat:
-                break
-        self.platform_obj.sendall(("LINS"+str(self.lins)+":INIT:IMM\n").encode())
-        while True:
-            self.platform_obj.sendall(("LINS"+str(self.lins)+":STAT:OPER:BIT8:COND?\n").encode())
-            end = self.platform_obj.recv(4096).decode("utf-8")
-            if int(end) == 0:
-                break
-        self.platform_obj.sendall(("LINS"+str(self.lins)+":MMEM:STOR:MEAS:WDM "+str(filepath)+"\n").encode())
-        print("Trace saved in: "+str(filepath))
+        if timeout is None:
+            timeout = 60 + 3*self.sop_time*self.nSOP
+        # The configuration writes that change a setting leave in a single packet
+        module = "LINS"+str(self.lins)
+        shadow = shadowFor(self.platform_obj)
+        with self.platform_obj.batch():
+            for setting, value in [("SENS:CORR:OFFS:MAGN", "0.0 DB"),
+                                   ("SENS:WAV:OFFS", "0 NM"),
+                                   ("SENS:WAV:STAR", str(self.wl_span[0])+" M"),
+                                   ("SENS:WAV:STOP", str(self.wl_span[1])+" M"),
+                                   ("SENS:AVER:STAT", "ON"),
+                                   ("SENS:AVER:TYPE", "PMMH"),
+                                   ("SENS:AVER:COUN", str(self.nSOP)),
+                                   ("TRIG:SEQ:SOUR", "IMM")]:
+                sep = ":" if setting == "SENS:AVER:TYPE" else " "
+                shadow.write(self.platform_obj, module, setting, value, module+":"+setting+sep+value)
+        waitFor(lambda: "READY" in self.platform_obj.query("LINS"+str(self.lins)+":STAT?"),
+                timeout, cancel=cancel, instrument=module, label="OSA ready")
+        self.acq_time = acquire(self.platform_obj,
+                                lambda: self.platform_obj.write("LINS"+str(self.lins)+":INIT:IMM"),
+                                lambda: waitFor(lambda: int(self.platform_obj.query("LINS"+str(self.lins)+":STAT:OPER:BIT8:COND?")) == 0,
+                                                timeout, cancel=cancel, instrument=module, label="OSA acquisition"),
+                                label=module+" acquisition")
+        if filepath is not None:
+            self.platform_obj.write("LINS"+str(self.lins)+":MMEM:STOR:MEAS:WDM "+str(filepath))
+            print("Trace saved in: "+str(filepath))
+        if store is not None:
+            record = self.results = self.getResults()
+            if not isinstance(store, ResultStore.ResultStore):
+                if self.store is None or self.store.path != Path(store):
+                    if self.store is not None:
+                        self.store.close()
+                    self.store = ResultStore.ResultStore(store, {name: ("(%d,)f8" % len(value) if np.ndim(value) else "f8")
+                                                                 for name, value in record.items()},
+                                                         attrs={"lins": self.lins, "platform": self.platform_name})
+                store = self.store
+            store.append(record)
+
+    # Method reading a binary block of little endian float64 values
+    def _queryArray(self, cmd):
+        shadowFor(self.platform_obj).write(self.platform_obj, "LINS"+str(self.lins), "FORM:DATA", "REAL,64",
+                                           "LINS"+str(self.lins)+":FORM:DATA REAL,64")
+        if self.platform_name == "IQS600":
+            return self.platform_obj.query_binary_values("LINS"+str(self.lins)+":"+cmd, datatype="d", container=np.array)
+        return np.frombuffer(self.platform_obj.queryBlock("LINS"+str(self.lins)+":"+cmd), dtype="<f8")
+
+    # Method returning the (wl, level) arrays of the last trace, in m and dBm
+    def getTrace(self):
+        return self._queryArray("TRAC:DATA:X?"), self._queryArray("TRAC:DATA:Y?")
+
+    # Method returning the WDM analysis of the last acquisition as arrays of
+    # the channel center wavelengths (m), powers (dBm) and in-band OSNR (dB)
+    def getWDM(self):
+        return {"ch_wl": self._queryArray("CALC:DATA:CWAV?"),
+                "ch_power": self._queryArray("CALC:DATA:CPOW?"),
+                "ch_osnr": self._queryArray("CALC:DATA:COSN?")}
+
+    # Method returning one record of the last acquisition (settings, trace
+    # and WDM results), channel arrays padded with NaN to max_channels
+    def getResults(self, max_channels=8):
+        wl, level = self.getTrace()
+        record = {"t": time.time(), "n_sop": self.nSOP, "acq_time": self.acq_time, "wl": wl, "level": level}
+        for name, values in self.getWDM().items():
+            padded = np.full(max_channels, np.nan)
+            padded[:min(len(values), max_channels)] = values[:max_channels]
+            record[name] = padded
+        return record
 
 
 class T100:
-    def __init__(self, GPIB0, interface=2):
-        rm = pyvisa.ResourceManager()
-        self.platform = rm.open_resource("GPIB"+str(interface)+"::"+str(GPIB0)+"::INSTR")
+    # settle=True replaces the fixed 5 s pauses with L?/P? readback polling,
+    # the observed settle time of the last operation is kept in self.settle_time
+    def __init__(self, GPIB0, interface=2, settle=False):
+        self.settle = settle
+        self.wl_tol = 0.001 # in nm
+        self.p_tol = 0.05 # in dBm or mW
+        self.settle_timeout = 30 # in s
+        self.settle_time = None
+        self.platform = ConnectionPool.pool.resource("GPIB"+str(interface)+"::"+str(GPIB0)+"::INSTR")
         print("Connexion established with: "+ self.platform.query("*IDN?"))
         #self.platform.write("AUTO_CAL")
         #time.sleep(15)
@@ -260,9 +1091,17 @@ class T100:
     def setmW(self):
         self.platform.write("MW")
 
+    def _settle(self, readback, target, tol):
+        if self.settle:
+            self.settle_time = waitSettle(lambda: float(readback()), target, tol, self.settle_timeout,
+                                          instrument=self.platform.address, label="T100 settle")
+        else:
+            tracer.sleep(5, self.platform.address, "T100 pause")
+            self.settle_time = 5
+
     def setWL(self, wl):
         self.platform.write("L="+str(wl))
-        time.sleep(5)
+        self._settle(self.getWL, float(wl), self.wl_tol)
 
     def getWL(self):
         wl = self.platform.query("L?")
@@ -271,7 +1110,7 @@ class T100:
 
     def setP(self, p):
         self.platform.write("P="+str(p))
-        time.sleep(5)
+        self._settle(self.getP, float(p), self.p_tol)
 
     def getP(self):
         p = self.platform.query("P?")
@@ -280,10 +1119,9 @@ class T100:
 
 class Keysight86122:
     def __init__(self, GPIB0, interface=0):
-        rm = pyvisa.ResourceManager()
-        self.platform = rm.open_resource("GPIB"+str(interface)+"::"+str(GPIB0)+"::INSTR")
+        self.platform = ConnectionPool.pool.resource("GPIB"+str(interface)+"::"+str(GPIB0)+"::INSTR")
         print("Connexion established with: "+ self.platform.query("*IDN?"))
-        time.sleep(5)
+        tracer.sleep(5, self.platform.address, "WLM init pause")
 
     def setPeakThreshold(self, peak_t):
         self.platform.write(":CALCulate2:PEXCursion "+str(peak_t))
@@ -292,12 +1130,43 @@ class Keysight86122:
         wls = self.platform.query(":CALCulate2:DATA? WAV")
         return wls
 
+    # Method returning the wavelengths (m) of every detected peak as floats
+    def getWLs(self):
+        return np.array(self.getWL().strip().split(","), dtype=np.float64)
+
+    # Method triggering a single measurement, waiting for its completion and
+    # returning its peaks as getWLs(); in continuous mode the data queries
+    # return the last measurement again until the next one completes, call
+    # setContinuous(False) first
+    def measure(self):
+        self.platform.query(":INITiate:IMMediate;*OPC?")
+        return self.getWLs()
+
+    def setContinuous(self, on=True):
+        self.platform.write(":INITiate:CONTinuous "+("ON" if on else "OFF"))
+
+    # Method starting a background WavemeterStream of this wavemeter
+    def stream(self, size=100000, **kwargs):
+        import WavemeterStream
+        return WavemeterStream.WavemeterStream(self, size, **kwargs).start()
+
 
 class Yokogawa:
-    def __init__(self, GPIB0, interface=1):
-        rm = pyvisa.ResourceManager()
-        self.platform = rm.open_resource("GPIB"+str(interface)+"::"+str(GPIB0)+"::INSTR")
-        print("Connexion established with: "+ self.platform.query("*IDN?"))
+    # srq=True waits for sweeps through GPIB service requests instead of
+    # polling the operation event register
+    # correct=True applies the saved calibration model of this OSA (see
+    # Calibration.py) to the peaks of getPeaks(), use correct=False to
+    # acquire calibration data
+    def __init__(self, GPIB0, interface=1, srq=False, correct=True):
+        self.srq = srq
+        self.acq_time = None
+        self.platform = ConnectionPool.pool.resource("GPIB"+str(interface)+"::"+str(GPIB0)+"::INSTR")
+        self.idn = self.platform.query("*IDN?").strip()
+        print("Connexion established with: "+ self.idn)
+        self.correction = Calibration.forInstrument(self.idn) if correct else None
+        if self.correction is not None:
+            print("Wavelength correction loaded: "+self.correction.kind+", residual "
+                  +str(round(self.correction.stats["residual_rms_pm"], 2))+" pm rms")
         self.platform.write(":SENSe:CORRection:RVELocity:MEDium VAC")
         self.platform.write(":SENSe:SWEep:SPEed 1x")
         self.platform.write(":UNIT:X WAVelength")
@@ -311,32 +1180,239 @@ class Yokogawa:
         self.platform.write(":TRIG:STAT OFF")
         self.platform.write(":SENSe:BWIDth 0.2NM")
         self.platform.write(":SENSe:SWEep:POINts 5001")
-        time.sleep(10)
+        shadowFor(self.platform).record("", "points", 5001, ":SENSe:SWEep:POINts 5001")
+        shadowFor(self.platform).record("", "speed", "1x", ":SENSe:SWEep:SPEed 1x")
+        self.point_time = 1e-3 # expected sweep time per point at 2x speed (s)
+        self.bandwidth = 0.2 # nm
+        if self.srq:
+            # Sweep complete (operation bit 0) raises the OPER summary bit of the status byte
+            self.platform.write(":STATus:OPERation:ENABle 1")
+            self.platform.write("*SRE 128")
+        tracer.sleep(10, self.platform.address, "OSA init pause")
 
+    # Sweep settings are only written when they change
     def setSweepCenter(self, wl=1550):
-        self.platform.write(":SENS:WAV:CENT "+str(wl)+"NM")
+        shadowFor(self.platform).write(self.platform, "", "center", wl, ":SENS:WAV:CENT "+str(wl)+"NM")
 
     def setSweepSpan(self, span=10):
-        self.platform.write(":SENSe:WAVelength:SPAN "+str(span)+"NM")
+        shadowFor(self.platform).write(self.platform, "", "span", span, ":SENSe:WAVelength:SPAN "+str(span)+"NM")
 
     def setSweepPoints(self, pts=5000):
-        self.platform.write(":SENSe:SWEep:POINts "+str(pts))
+        shadowFor(self.platform).write(self.platform, "", "points", pts, ":SENSe:SWEep:POINts "+str(pts))
 
-    def sweep(self):
-        self.platform.write(":INITiate")
-        wait_bit = int(self.platform.query(":STATus:OPERation:EVENt?"))
-        while wait_bit != 1:
-            time.sleep(1)
-            wait_bit = int(self.platform.query(":STATus:OPERation:EVENt?"))
+    # speed is "1x" or "2x"
+    def setSweepSpeed(self, speed="1x"):
+        shadowFor(self.platform).write(self.platform, "", "speed", speed, ":SENSe:SWEep:SPEed "+speed)
+
+    def reset(self):
+        self.platform.write("*RST")
+
+    # Method running a single sweep and waiting for its completion
+    # timeout (s) bounds the wait, by default 30 s plus three times the
+    # expected sweep time (points*point_time, doubled at 1x speed); cancel is
+    # an optional threading.Event
+    # Returns the measured acquisition time, also kept in self.acq_time
+    def sweep(self, timeout=None, cancel=None):
+        if timeout is None:
+            shadow = shadowFor(self.platform)
+            points = shadow.values.get(("", "points"), 50001)
+            speed = 1 if shadow.values.get(("", "speed")) == "2x" else 2
+            timeout = 30 + 3*self.point_time*points*speed
+        start = [None]
+        def begin():
+            # Clear a completion left latched by a previous sweep
+            self.platform.query(":STATus:OPERation:EVENt?")
+            start[0] = time.perf_counter()
+            self.platform.write(":INITiate")
+        def wait():
+            if self.srq:
+                self._waitSRQ(start[0], timeout, cancel)
+                self.platform.query(":STATus:OPERation:EVENt?")
+            else:
+                waitFor(lambda: int(self.platform.query(":STATus:OPERation:EVENt?")) & 1,
+                        timeout, cancel=cancel, instrument=self.platform.address, label="OSA sweep")
+        acquire(self.platform, begin, wait, label=self.platform.address+" sweep")
+        self.acq_time = time.perf_counter() - start[0]
+        return self.acq_time
+
+    # Method waiting for the service request in short slices so the wait
+    # stays cancellable and bounded
+    # An I/O error other than the slice timeout reopens the session before
+    # being raised, so sweep() restarts the sweep on the new session
+    def _waitSRQ(self, start, timeout, cancel, slice_ms=200):
+        while True:
+            try:
+                self.platform.wait_for_srq(slice_ms)
+                return
+            except pyvisa.errors.VisaIOError as e:
+                if e.error_code != pyvisa.constants.StatusCode.error_timeout:
+                    self.platform.reconnect()
+                    raise
+            if cancel is not None and cancel.is_set():
+                raise WaitCancelled("Sweep wait cancelled")
+            if timeout is not None and time.perf_counter() - start > timeout:
+                raise TimeoutError("Sweep not completed within "+str(timeout)+" s")
 
     def getPeaks(self, peak_thresh):
-        self.platform.write(":CALCulate:CATegory SWRMS")
-        self.platform.write(":CALC:PAR:SWPK:TH "+str(np.abs(peak_thresh)))
-        self.platform.write(":CALCulate:PARameter:SWRMS:K 2.00")
+        shadow = shadowFor(self.platform)
+        shadow.write(self.platform, "", "category", "SWRMS", ":CALCulate:CATegory SWRMS")
+        shadow.write(self.platform, "", "threshold", np.abs(peak_thresh), ":CALC:PAR:SWPK:TH "+str(np.abs(peak_thresh)))
+        shadow.write(self.platform, "", "k", 2.0, ":CALCulate:PARameter:SWRMS:K 2.00")
         self.platform.write(":CALCulate:IMMediate")
         res = self.platform.query("CALCulate:DATA?")
+        if self.correction is not None:
+            # First SWRMS field is the peak wavelength (m)
+            fields = res.strip().split(",")
+            fields[0] = "%+.8E" % self.correction.apply(float(fields[0]))
+            res = ",".join(fields)
         return res
 
+    # Method returning the center wavelengths (m) of every line above
+    # peak_thresh (dB below the highest) in the last sweep, from the WDM
+    # channel analysis (SWRMS gives a single center for the whole spectrum)
+    # The calibration model, if any, is applied to the whole array at once
+    def getChannelPeaks(self, peak_thresh=-20):
+        shadow = shadowFor(self.platform)
+        shadow.write(self.platform, "", "category", "WDM", ":CALCulate:CATegory WDM")
+        shadow.write(self.platform, "", "wdm_threshold", np.abs(peak_thresh),
+                     ":CALCulate:PARameter:WDM:TH "+str(np.abs(peak_thresh))+"DB")
+        self.platform.write(":CALCulate:IMMediate")
+        reply = self.platform.query(":CALCulate:DATA:CWAVelengths?").strip()
+        peaks = np.array(reply.split(","), dtype=np.float64) if reply else np.zeros(0)
+        if self.correction is not None:
+            peaks = self.correction.apply(peaks)
+        return peaks
+
+    # Method measuring a single laser line around center (nm) in two sweeps
+    # 1. Coarse 2x speed sweep of span (nm) with coarse_pts points
+    # 2. 1x speed sweep zoomed on the coarse peak, over the coarse step
+    #    uncertainty and the resolution bandwidth, with the step giving a
+    #    sampling uncertainty (step/sqrt(12)) of accuracy (pm)
+    # Returns (peak, uncertainty) in m, the uncertainty including the
+    # residual of the calibration model when one is applied
+    # The zoomed settings stay active, the next call restores the coarse ones
+    def fastPeak(self, center, accuracy=1.0, span=10, coarse_pts=1001, peak_thresh=-20, timeout=None, cancel=None):
+        start = time.perf_counter()
+        self.setSweepSpeed("2x")
+        self.setSweepCenter(center)
+        self.setSweepSpan(span)
+        self.setSweepPoints(coarse_pts)
+        self.sweep(timeout, cancel)
+        coarse = float(self.getPeaks(peak_thresh).split(",")[0])
+        if not np.isfinite(coarse) or coarse <= 0:
+            raise ValueError("No peak found around "+str(center)+" nm")
+        coarse_step = span/(coarse_pts - 1)
+        zoom_span = round(4*coarse_step + 3*self.bandwidth, 4)
+        step = accuracy*1e-3*np.sqrt(12)
+        # AQ6370D sweeps take 101 to 50001 points
+        zoom_pts = int(min(max(np.ceil(zoom_span/step) + 1, 101), 50001))
+        self.setSweepSpeed("1x")
+        self.setSweepCenter(round(coarse*1e9, 4))
+        self.setSweepSpan(zoom_span)
+        self.setSweepPoints(zoom_pts)
+        self.sweep(timeout, cancel)
+        peak = float(self.getPeaks(peak_thresh).split(",")[0])
+        self.acq_time = time.perf_counter() - start
+        uncertainty = zoom_span/(zoom_pts - 1)*1e-9/np.sqrt(12)
+        if self.correction is not None:
+            uncertainty = np.hypot(uncertainty, self.correction.stats["residual_rms_pm"]*1e-12)
+        return peak, uncertainty
+
+    # Method reading an IEEE 488.2 definite length block of little endian
+    # float64 straight into the preallocated array out
+    def _readBlock(self, cmd, out):
+        self.platform.write(cmd)
+        head = self.platform.read_bytes(2, break_on_termchar=False)
+        if head[:1] != b"#":
+            raise ValueError("Expected a binary block, got "+repr(head))
+        nbytes = int(self.platform.read_bytes(int(head[1:2]), break_on_termchar=False))
+        data = self.platform.read_bytes(nbytes, break_on_termchar=False)
+        # Block is followed by the LF message terminator
+        self.platform.read_bytes(1)
+        n = nbytes//8
+        out[:n] = np.frombuffer(data, dtype="<f8")
+        return n
+
+    # Method downloading full traces in binary
+    # traces is a trace name ("A") or a list of names (["A", "B", "C"])
+    # Returns (wl, level) arrays in m and in the display level unit, 1D for a
+    # single trace, 2D with one row per trace otherwise (rows shorter than
+    # the longest trace are padded with NaN)
+    def getTrace(self, traces="A"):
+        names = [traces] if isinstance(traces, str) else list(traces)
+        npts = [int(self.platform.query(":TRACe:SNUMber? TR"+name)) for name in names]
+        wl = np.full((len(names), max(npts)), np.nan)
+        level = np.full((len(names), max(npts)), np.nan)
+        self.platform.write(":FORMat:DATA REAL,64")
+        try:
+            for i, name in enumerate(names):
+                self._readBlock(":TRACe:X? TR"+name, wl[i])
+                self._readBlock(":TRACe:Y? TR"+name, level[i])
+        finally:
+            # getPeaks() and the scripts parse ASCII replies
+            self.platform.write(":FORMat:DATA ASCii")
+        if isinstance(traces, str):
+            return wl[0], level[0]
+        return wl, level
+
+# Registry of the drivers, name -> "module:class", imported on first use
+# Drivers kept in other modules are added with registerDriver()
+DRIVERS = {name: "InstrumentControl:"+name for name in
+           ["IQS", "LTB", "VOA", "TLS", "DFB", "OSA", "MPC_201", "T100", "Keysight86122", "Yokogawa"]}
+
+# Platforms reachable by name in openInstrument(), name -> (type, arguments)
+# The type ("LTB8" or "IQS600") is the platform name given to the modules
+PLATFORMS = {"LTB8": ("LTB8", ("169.254.244.64", 5025)),
+             "IQS600": ("IQS600", (12,))}
+_PLATFORM_DRIVERS = {"LTB8": "LTB", "IQS600": "IQS"}
+_platforms = {}
+_platforms_lock = threading.Lock()
+
+def registerDriver(name, target):
+    DRIVERS[name] = target
+
+# Function adding a platform, e.g. definePlatform("LTB8-B", "LTB8", "169.254.244.65", 5025)
+def definePlatform(name, platform_type, *args):
+    with _platforms_lock:
+        PLATFORMS[name] = (platform_type, args)
+        _platforms.pop(name, None)
+
+# Function returning the driver class registered under name
+def driverClass(name):
+    if name not in DRIVERS:
+        raise KeyError("Unknown driver "+repr(name)+", registered: "+", ".join(sorted(DRIVERS)))
+    module, _, attr = DRIVERS[name].partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+# Function returning (type, platform object) of a named platform, connected
+# once and shared by every module opened on it
+def platformFor(name):
+    with _platforms_lock:
+        if name not in PLATFORMS:
+            raise KeyError("Unknown platform "+repr(name)+", defined: "+", ".join(sorted(PLATFORMS)))
+        platform_type, args = PLATFORMS[name]
+        if name not in _platforms:
+            _platforms[name] = driverClass(_PLATFORM_DRIVERS[platform_type])(*args).platform
+        return platform_type, _platforms[name]
+
+# Function opening an instrument from its address and driver name
+# "<platform>:LINS<n>/<driver>" opens module n of a named platform,
+# "GPIB<board>::<address>/<driver>" a GPIB instrument; keyword arguments
+# are passed to the driver
+def openInstrument(spec, **kwargs):
+    address, _, name = spec.rpartition("/")
+    if not address:
+        raise ValueError("Expected <address>/<driver>, got "+repr(spec))
+    cls = driverClass(name)
+    if address.startswith("GPIB"):
+        board, _, gpib = address[4:].partition("::")
+        return cls(int(gpib), int(board or 0), **kwargs)
+    platform, _, slot = address.partition(":")
+    if not slot.startswith("LINS"):
+        raise ValueError("Expected <platform>:LINS<n>, got "+repr(address))
+    platform_type, platform_obj = platformFor(platform)
+    return cls(platform_type, platform_obj, int(slot[4:]), **kwargs)
+
 """
 # Declaring platforms example
 ltb8 = LTB('169.254.244.64', 5025).platform
@@ -350,6 +1426,10 @@ voa_ase = VOA("IQS600", iqs600, 3)
 voa_scr = VOA("LTB8", ltb8, 1)
 tls = TLS("LTB8", ltb8, 0)
 osa = OSA("LTB8", ltb8, 4)
+
+# Same through the registry
+osa = openInstrument("LTB8:LINS4/OSA")
+yoko = openInstrument("GPIB0::16/Yokogawa")
 """
 
 
@@ -0,0 +1,273 @@
+"""
+Simulated instrument backends to exercise InstrumentControl without hardware
+1. LTBSimulator: local TCP SCPI server emulating the LTB LINSx: command set
+   of the VOA, TLS/DFB and OSA modules, with per-command latency, settle
+   times of the VOA/TLS readbacks and OSA acquisition time models
+2. InstrumentSimulator.yaml: pyvisa-sim profile of the GPIB instruments
+   (IQS-600 VOAs, MPC-201, T100, Keysight 86122, Yokogawa AQ6370D), used by
+   setting PYVISA_LIBRARY to "<path>/InstrumentSimulator.yaml@sim"
+3. SimLatency: wrapper adding per-command latency and busy times (settling,
+   sweeps) to a simulated VISA session
+
+Example:
+    sim = InstrumentSimulator.LTBSimulator(latency=0.001)
+    host, port = sim.start()
+    ltb8 = InstrumentControl.LTB(host, port).platform
+"""
+# Import library for the simulated LTB server
+import socketserver
+# Import library for the server thread and shared state lock
+import threading
+# Import libraries for the simulated OSA traces
+import math
+import struct
+# Import library for the latency and settle models
+import time
+from pathlib import Path
+
+# pyvisa-sim profile of the GPIB instruments
+SIM_PROFILE = str(Path(__file__).with_name("InstrumentSimulator.yaml"))
+
+# Function formatting a float the way the LTB modules reply
+def _fmt(value):
+    return "%+.8E" % value
+
+# Setting whose readback ramps linearly to its setpoint over settle seconds
+class SettleModel:
+    def __init__(self, value, settle=0.0):
+        self.settle = settle
+        self.start_value = value
+        self.target = value
+        self.t0 = 0.0
+
+    def set(self, value):
+        self.start_value = self.read()
+        self.target = value
+        self.t0 = time.perf_counter()
+
+    def read(self):
+        if self.settle <= 0:
+            return self.target
+        frac = min((time.perf_counter() - self.t0)/self.settle, 1.0)
+        return self.start_value + (self.target - self.start_value)*frac
+
+# Simulated VOA module
+class SimVOA:
+    def __init__(self, min_att=0.0, max_att=60.0, settle=0.2):
+        self.min_att = min_att
+        self.max_att = max_att
+        self.att = SettleModel(min_att, settle)
+        self.state = 0
+
+    def handle(self, cmd, arg):
+        if cmd == "INP:ATT?":
+            if arg == "MIN":
+                return _fmt(self.min_att)
+            if arg == "MAX":
+                return _fmt(self.max_att)
+            return _fmt(self.att.read())
+        if cmd == "INP:ATT":
+            self.att.set(min(max(float(arg.split()[0]), self.min_att), self.max_att))
+        elif cmd == "OUTP:STAT":
+            self.state = int(arg)
+        elif cmd == "OUTP:STAT?":
+            return str(self.state)
+
+# Simulated multi-channel TLS module (a DFB is a single channel TLS)
+class SimTLS:
+    def __init__(self, channels=4, min_wl=1.527e-6, max_wl=1.567e-6, min_pow=-10.0, max_pow=10.0,
+                 wl_settle=2.0, pow_settle=0.5, stat_settle=1.0):
+        self.min_wl = min_wl
+        self.max_wl = max_wl
+        self.min_pow = min_pow
+        self.max_pow = max_pow
+        self.freq = [SettleModel(299792458.0/1.55e-6, wl_settle) for _ in range(channels)]
+        self.pow = [SettleModel(max_pow, pow_settle) for _ in range(channels)]
+        self.stat = [SettleModel(0, stat_settle) for _ in range(channels)]
+
+    def handle(self, cmd, arg):
+        parts = cmd.split(":")
+        ch = int(parts[0][4:] or 1) - 1 # SOUR, SOUR1 ... SOUR4
+        rest = ":".join(parts[1:])
+        if rest == "POW:WAV?":
+            return _fmt(self.min_wl if arg == "MIN" else self.max_wl)
+        if rest == "POW?":
+            if arg == "MIN":
+                return _fmt(self.min_pow)
+            if arg == "MAX":
+                return _fmt(self.max_pow)
+            return _fmt(self.pow[ch].read())
+        if cmd == "SOUR:COUN?":
+            return str(len(self.freq))
+        if rest == "POW":
+            self.pow[ch].set(float(arg.split()[0]))
+        elif rest == "POW:FREQ":
+            self.freq[ch].set(float(arg.split()[0]))
+        elif rest == "POW:FREQ?":
+            return _fmt(self.freq[ch].read())
+        elif rest == "POW:STAT":
+            self.stat[ch].set(int(arg))
+        elif rest == "POW:STAT?":
+            return str(int(round(self.stat[ch].read())))
+
+# Function formatting values as an IEEE 488.2 block of little endian float64
+def _block(values):
+    data = struct.pack("<%dd" % len(values), *values)
+    length = str(len(data))
+    return b"#"+str(len(length)).encode()+length.encode()+data
+
+# Simulated OSA module, an in-band acquisition lasts overhead + nSOP*sop_time
+# Traces hold points samples of a single line at line_wl (m) over the span,
+# sent as binary blocks
+class SimOSA:
+    def __init__(self, sop_time=0.002, overhead=0.5, points=1001, line_wl=1.55e-6):
+        self.sop_time = sop_time
+        self.overhead = overhead
+        self.points = points
+        self.line_wl = line_wl
+        self.settings = {}
+        self.busy_until = 0.0
+        self.saved = []
+
+    def _trace(self):
+        # Ranges given in nm by the scripts are converted to m
+        start, stop = [float(self.settings.get(name, default).split()[0]) for name, default in
+                       (("SENS:WAV:STAR", "1545e-9 M"), ("SENS:WAV:STOP", "1555e-9 M"))]
+        start, stop = [x*1e-9 if x > 1 else x for x in (start, stop)]
+        wl = [start + (stop - start)*i/(self.points - 1) for i in range(self.points)]
+        level = [-60 + 60*math.exp(-((w - self.line_wl)/0.05e-9)**2) for w in wl]
+        return wl, level
+
+    def handle(self, cmd, arg):
+        if cmd == "TRAC:DATA:X?":
+            return _block(self._trace()[0])
+        if cmd == "TRAC:DATA:Y?":
+            return _block(self._trace()[1])
+        if cmd == "CALC:DATA:CWAV?":
+            return _block([self.line_wl])
+        if cmd == "CALC:DATA:CPOW?":
+            return _block([0.0])
+        if cmd == "CALC:DATA:COSN?":
+            return _block([40.0])
+        if cmd == "STAT?":
+            return "BUSY" if time.perf_counter() < self.busy_until else "READY"
+        if cmd == "STAT:OPER:BIT8:COND?":
+            return "1" if time.perf_counter() < self.busy_until else "0"
+        if cmd == "INIT:IMM":
+            n_sop = int(float(self.settings.get("SENS:AVER:COUN", "1")))
+            self.busy_until = time.perf_counter() + self.overhead + n_sop*self.sop_time
+        elif cmd == "MMEM:STOR:MEAS:WDM":
+            self.saved.append(arg)
+        elif cmd.endswith("?"):
+            return self.settings.get(cmd[:-1], "0")
+        else:
+            self.settings[cmd] = arg
+
+class _LTBHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        sim = self.server.sim
+        for raw in self.rfile:
+            line = raw.decode("utf-8").strip()
+            if not line:
+                continue
+            reply = sim.execute(line)
+            if isinstance(reply, bytes):
+                self.wfile.write(reply+b"\n")
+            elif reply is not None:
+                self.wfile.write((reply+"\n").encode("utf-8"))
+
+class _LTBServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+# Local TCP SCPI server emulating an LTB-8 frame
+# modules maps the LINS number as sent by the drivers ("1", "10") to SimVOA,
+# SimTLS or SimOSA objects, latency (s) is added to every command
+class LTBSimulator:
+    def __init__(self, modules=None, latency=0.0005, host="127.0.0.1", port=0):
+        if modules is None:
+            modules = {"0": SimTLS(), "1": SimVOA(), "4": SimTLS(channels=1), "5": SimOSA()}
+        self.modules = modules
+        self.latency = latency
+        self.address = (host, port)
+        self.commands = 0
+        self.queries = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    # Method executing one command line, returns the reply of a query
+    def execute(self, line):
+        if self.latency:
+            time.sleep(self.latency)
+        head, _, arg = line.partition(" ")
+        with self._lock:
+            self.commands += 1
+            if head.endswith("?"):
+                self.queries += 1
+            if head == "*IDN?":
+                return "EXFO,LTB-8,SIMULATOR,1.0"
+            if head.startswith("LINS"):
+                lins, _, cmd = head[4:].partition(":")
+                module = self.modules.get(lins)
+                if module is not None and cmd == "SNUM?":
+                    return "SIM"+lins.zfill(4)
+                if module is not None:
+                    reply = module.handle(cmd, arg.strip())
+                    if reply is not None or not head.endswith("?"):
+                        return reply
+        # Unknown queries still get a reply so the framing stays aligned
+        return "" if head.endswith("?") else None
+
+    # Method starting the server in a background thread, returns (host, port)
+    def start(self):
+        self._server = _LTBServer(self.address, _LTBHandler)
+        self._server.sim = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.address = self._server.server_address
+        return self.address
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+# Wrapper adding latency and busy times to a (simulated) VISA session
+# busy maps a command prefix to the time (s) the instrument stays busy after
+# it, e.g. {"L=": 1.0} for a T100 retune or {":INITiate": 0.5} for a sweep;
+# queries issued while busy block until the instrument is free again
+class SimLatency:
+    def __init__(self, resource, latency=0.002, busy=None):
+        self.resource = resource
+        self.latency = latency
+        self.busy = busy or {}
+        self.busy_until = 0.0
+        self.commands = 0
+
+    def _command(self, cmd):
+        self.commands += 1
+        time.sleep(self.latency)
+        for prefix, duration in self.busy.items():
+            if cmd.startswith(prefix):
+                self.busy_until = time.perf_counter() + duration
+
+    def write(self, cmd, *args, **kwargs):
+        self._command(cmd)
+        return self.resource.write(cmd, *args, **kwargs)
+
+    def query(self, cmd, *args, **kwargs):
+        self._command(cmd)
+        remaining = self.busy_until - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+        return self.resource.query(cmd, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
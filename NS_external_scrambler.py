@@ -1,11 +1,25 @@
 import InstrumentControl
+import Campaign
+import RunningStats
 import numpy as np
 import time
 
-# Declaring platforms and modules
-ltb8 = InstrumentControl.LTB('169.254.244.64', 5025).platform
-osa = InstrumentControl.OSA("LTB8", ltb8, 5)
-dfb = InstrumentControl.DFB("LTB8", ltb8, 4)
+# Chassis running the study, each one with its own OSA/DFB chain
+# Add an entry per LTB frame to split the study across frames
+chassis = [{"name": "LTB8-A", "address": '169.254.244.64', "osa": 5, "dfb": 4}]
+
+# Declaring platforms and modules, done in the worker of each chassis
+def setup(spec):
+    ltb8 = InstrumentControl.LTB(spec["address"], 5025).platform
+    osa = InstrumentControl.OSA("LTB8", ltb8, spec["osa"])
+    dfb = InstrumentControl.DFB("LTB8", ltb8, spec["dfb"])
+    return osa
+
+def step(osa, point):
+    k, nsop = point
+    osa.inband_Analysis([1545, 1555], nsop, "C:/OSA/2024-04-22_NS-scrambler"+"_"+str(k)+"_"+str(nsop)+".xosawdm")
+    results = osa.getResults()
+    return {"acq_time": osa.acq_time, "osnr": results["ch_osnr"][0], "power": results["ch_power"][0]}
 
 
 from datetime import datetime
@@ -22,16 +36,22 @@ nsops = [1000, 2000, 5000]
 warmup = 60*30*0
 rep = 10
 
-time.sleep(warmup)
-for k in range(rep):
-    for nsop in nsops:
-        time.sleep(1)
-        osa.inband_Analysis([1545, 1555], nsop, "C:/OSA/2024-04-22_NS-scrambler"+"_"+str(k)+"_"+str(nsop)+".xosawdm")
-        time.sleep(1)
-        now = datetime.now()
-
-        current_time = now.strftime("%H:%M:%S")
-        print("Current Time =", current_time)
-        print('NSOP: '+str(nsop))
-        print('Repetition: '+str(k))
+# Repetitions of an nsop stop once its mean OSNR is known within +/-0.05 dB (95 %)
+stats = RunningStats.RunningStats({"osnr": (20, 60), "power": (-30, 10)}, targets={"osnr": 0.05}, min_count=5)
 
+def on_result(name, index, point, result, error):
+    if error is None:
+        stats.add(point[1], osnr=result["osnr"], power=result["power"])
+
+# Completed points are journaled, a restarted run only acquires the missing ones
+journal = Campaign.Journal("C:/OSA/2024-04-22_NS-scrambler_journal.jsonl")
+
+time.sleep(warmup)
+runner = Campaign.MultiPlatformRunner(chassis, setup, step, on_result=on_result, skip=lambda point: stats.done(point[1]),
+                                      journal=journal)
+runner.run([(k, nsop) for k in range(rep) for nsop in nsops])
+journal.close()
+for error in runner.errors:
+    print(error)
+print(str(len(runner.skipped))+" acquisitions skipped")
+stats.printSummary()
@@ -0,0 +1,176 @@
+"""
+Columnar, append-only result store for calibration and sweep campaigns
+A store is a directory holding one raw little endian binary file per column
+(<column>.bin) and a meta.json with the column types, the number of
+committed rows and free-form attributes (instrument IDN, study parameters)
+
+1. Records are buffered and written in chunks
+2. A chunk is committed only once its data is fsynced and meta.json has been
+   atomically replaced, rows left over by a crash are discarded on reopen
+3. Columns are read back as read-only NumPy memmaps, a large run loads
+   instantly
+4. Array columns ("(1001,)f8") hold one fixed-size array per record, such
+   as an OSA trace, and read back as 2D memmaps
+
+Example:
+    store = ResultStore.ResultStore("C:/OSA/calibration", {"setpoint": "f8", "osa": "f8", "wlm": "f8", "t": "f8"},
+                                    attrs={"osa_idn": osa_id})
+    store.append(setpoint=wl, osa=osa_peak, wlm=wlm_peak, t=time.time())
+    store.close()
+    data = ResultStore.load("C:/OSA/calibration")
+"""
+# Import library for the meta file
+import json
+# Import library for fsync and atomic replace
+import os
+# Import library for the legacy text parsing
+import re
+from pathlib import Path
+import numpy as np
+
+# Function returning the little endian version of a column type
+def _littleEndian(dt):
+    dt = np.dtype(dt)
+    if dt.shape:
+        return np.dtype((dt.base.newbyteorder("<"), dt.shape))
+    return dt.newbyteorder("<")
+
+# Function returning the meta.json form of a column type, "(1001,)<f8" for
+# array columns whose dtype.str would lose the shape
+def _dtypeStr(dt):
+    return str(dt.shape)+dt.base.str if dt.shape else dt.str
+
+class ResultStore:
+    # Opens the store at path, creating it when columns (name -> NumPy dtype)
+    # are given, an existing store keeps its own columns
+    # chunk_rows is the number of buffered records per committed chunk
+    # readonly=True opens an existing store without touching its files
+    def __init__(self, path, columns=None, attrs=None, chunk_rows=256, readonly=False):
+        self.path = Path(path)
+        self.chunk_rows = chunk_rows
+        self.readonly = readonly
+        meta_path = self.path / "meta.json"
+        if meta_path.exists():
+            with open(meta_path) as f:
+                meta = json.load(f)
+            self.dtypes = {name: np.dtype(dt) for name, dt in meta["columns"].items()}
+            self.rows = meta["rows"]
+            self.attrs = meta["attrs"]
+        elif columns is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.dtypes = {name: _littleEndian(dt) for name, dt in columns.items()}
+            self.rows = 0
+            self.attrs = {}
+        else:
+            raise FileNotFoundError("No result store at "+str(self.path)+" and no columns given")
+        if attrs:
+            self.attrs.update(attrs)
+        self._buffer = {name: [] for name in self.dtypes}
+        if self.readonly:
+            return
+        # Drop the rows written after the last commit
+        for name, dt in self.dtypes.items():
+            with open(self._columnPath(name), "ab") as f:
+                f.truncate(self.rows*dt.itemsize)
+        self._writeMeta()
+
+    def _columnPath(self, name):
+        return self.path / (name+".bin")
+
+    def _writeMeta(self):
+        tmp = self.path / "meta.json.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"columns": {name: _dtypeStr(dt) for name, dt in self.dtypes.items()},
+                       "rows": self.rows, "attrs": self.attrs}, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path / "meta.json")
+
+    # Method buffering one record, every column must be given
+    def append(self, record=None, **fields):
+        if record is not None:
+            fields.update(record)
+        for name in self.dtypes:
+            self._buffer[name].append(fields[name])
+        if len(self._buffer[name]) >= self.chunk_rows:
+            self.flush()
+
+    # Method buffering many records at once from a dict of column arrays
+    def extend(self, columns):
+        for name in self.dtypes:
+            self._buffer[name].extend(columns[name])
+        if len(self._buffer[name]) >= self.chunk_rows:
+            self.flush()
+
+    # Method committing the buffered records to disk
+    def flush(self):
+        n = len(next(iter(self._buffer.values())))
+        if n == 0:
+            return
+        if self.readonly:
+            raise PermissionError("Result store "+str(self.path)+" is opened read-only")
+        for name, dt in self.dtypes.items():
+            with open(self._columnPath(name), "ab") as f:
+                # base is the element type of array columns, dt itself otherwise
+                f.write(np.asarray(self._buffer[name], dtype=dt.base).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._buffer[name] = []
+        self.rows += n
+        self._writeMeta()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.rows + len(next(iter(self._buffer.values())))
+
+    # Method returning a committed column as a read-only memmap
+    def column(self, name):
+        if self.rows == 0:
+            return np.empty(0, dtype=self.dtypes[name])
+        return np.memmap(self._columnPath(name), dtype=self.dtypes[name], mode="r", shape=(self.rows,))
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    # Method returning every committed column
+    def columns(self):
+        return {name: self.column(name) for name in self.dtypes}
+
+# Function opening an existing store and returning its columns as memmaps
+def load(path):
+    return ResultStore(path, readonly=True).columns()
+
+# Instrument replies format exponents on three digits (+1.43999269E-006),
+# which separates values written without a delimiter
+_FLOAT = re.compile(r"[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[Ee][+-]?\d{1,3})?")
+
+# Function importing a legacy text result file (osa_calibration.py, test.py)
+# Handles the header line, blank lines and records written without newline
+# Three column files are named setpoint, osa and wlm, others keep their
+# header names; ncols is only needed for files without header (default 3)
+# With store_path the data is also written to a ResultStore
+# Returns a dict of column arrays
+def importLegacy(txt_path, store_path=None, ncols=None):
+    text = Path(txt_path).read_text()
+    first, _, body = text.partition("\n")
+    header = [h.strip() for h in first.split(",")]
+    if _FLOAT.fullmatch(header[0]):
+        header = None
+        body = text
+    ncols = len(header) if header else (ncols or 3)
+    values = np.array(_FLOAT.findall(body), dtype=np.float64)
+    values = values[:len(values)//ncols*ncols].reshape(-1, ncols)
+    names = ["setpoint", "osa", "wlm"] if ncols == 3 else header
+    data = {name: values[:, i] for i, name in enumerate(names)}
+    if store_path is not None:
+        with ResultStore(store_path, {name: "f8" for name in names}, attrs={"source": str(txt_path)}) as store:
+            store.extend(data)
+    return data
@@ -0,0 +1,140 @@
+"""
+Online statistics of repeated acquisitions
+Per-configuration statistics (scrambling rate, number of SOP ...) of any
+number of metrics (OSNR, power ...), updated as each result arrives in
+bounded memory
+
+1. Welford mean/variance, min/max
+2. Fixed-range histograms with underflow/overflow counts
+3. Convergence history (count, mean, confidence half width) at power of two
+   acquisition counts
+4. Early stopping: a configuration is done once the confidence interval of
+   every metric with a target half width is narrower than that target
+
+Example:
+    stats = RunningStats.RunningStats({"osnr": (20, 50), "power": (-20, 10)}, targets={"osnr": 0.05})
+    for i in range(n_acq):
+        osa.inband_Analysis([1545, 1555], n_av, store=path)
+        if stats.add(rate, osnr=osa.results["ch_osnr"][0], power=osa.results["ch_power"][0]):
+            break
+    stats.printSummary()
+"""
+# Import libraries for the statistics and the confidence quantile
+import math
+from statistics import NormalDist
+# Import library for the summary file
+import json
+
+# Running statistics of one metric
+# hist_range is the (low, high) range of the bins histogram, None for none
+class RunningStat:
+    def __init__(self, hist_range=None, bins=50):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.hist_range = hist_range
+        self.hist = [0]*bins if hist_range else None
+        self.underflow = 0
+        self.overflow = 0
+        self.history = [] # (count, mean, std) at counts 1, 2, 4 ...
+
+    def add(self, value):
+        if value is None:
+            return
+        value = float(value)
+        if math.isnan(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if self.hist is not None:
+            low, high = self.hist_range
+            if value < low:
+                self.underflow += 1
+            elif value >= high:
+                self.overflow += 1
+            else:
+                self.hist[int((value - low)/(high - low)*len(self.hist))] += 1
+        if self.count & (self.count - 1) == 0:
+            self.history.append((self.count, self.mean, self.std))
+
+    @property
+    def variance(self):
+        return self.m2/(self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance) if self.count > 1 else math.nan
+
+    # Method returning the half width of the confidence interval of the mean
+    # (normal approximation)
+    def halfWidth(self, confidence=0.95):
+        if self.count < 2:
+            return math.inf
+        return NormalDist().inv_cdf((1 + confidence)/2)*self.std/math.sqrt(self.count)
+
+    def toDict(self, confidence=0.95):
+        return {"count": self.count, "mean": self.mean, "std": self.std, "min": self.min, "max": self.max,
+                "half_width": self.halfWidth(confidence), "hist_range": self.hist_range, "hist": self.hist,
+                "underflow": self.underflow, "overflow": self.overflow, "history": self.history}
+
+# Statistics of several metrics for every configuration
+# metrics maps each metric name to its histogram range (or None), targets
+# maps metric names to the confidence half width ending a configuration,
+# min_count acquisitions are always taken (the normal approximation is poor
+# below), max_count optionally caps them
+class RunningStats:
+    def __init__(self, metrics, targets=None, confidence=0.95, bins=50, min_count=10, max_count=None):
+        self.metrics = metrics
+        self.targets = targets or {}
+        self.confidence = confidence
+        self.bins = bins
+        self.min_count = min_count
+        self.max_count = max_count
+        self.configs = {}
+        self._done = set()
+
+    # Method adding one result of config (a hashable key), returns True once
+    # the configuration has converged
+    def add(self, config, **values):
+        stats = self.configs.get(config)
+        if stats is None:
+            stats = self.configs[config] = {name: RunningStat(r, self.bins) for name, r in self.metrics.items()}
+        for name, value in values.items():
+            stats[name].add(value)
+        if self._converged(stats):
+            self._done.add(config)
+        return config in self._done
+
+    def _converged(self, stats):
+        count = min(stat.count for stat in stats.values())
+        if self.max_count is not None and count >= self.max_count:
+            return True
+        if not self.targets or count < self.min_count:
+            return False
+        return all(stats[name].halfWidth(self.confidence) <= target for name, target in self.targets.items())
+
+    # Method telling whether a configuration needs no more acquisitions
+    def done(self, config):
+        return config in self._done
+
+    def __getitem__(self, config):
+        return self.configs[config]
+
+    def printSummary(self):
+        for config, stats in self.configs.items():
+            print(str(config)+(" (converged)" if config in self._done else ""))
+            for name, stat in stats.items():
+                print("  %-10s n=%-6d mean=%.4f std=%.4f min=%.4f max=%.4f +/-%.4f" % (
+                    name, stat.count, stat.mean, stat.std, stat.min, stat.max, stat.halfWidth(self.confidence)))
+
+    # Method writing every statistic as JSON, configurations keyed by str()
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({str(config): {name: stat.toDict(self.confidence) for name, stat in stats.items()}
+                       for config, stats in self.configs.items()}, f, indent=1)
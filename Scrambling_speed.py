@@ -1,4 +1,6 @@
 import InstrumentControl
+import Campaign
+import RunningStats
 import numpy as np
 import time
 
@@ -26,25 +28,44 @@ nsops = [1000,2000,3000,4000,5000]
 # Insturment Warmup time (s)
 warmup = 60*30*0
 rep = 5
+# Repetitions stay the outer loop so they are interleaved over the whole study,
+# scrambling rate changes cost 2 s of scrambler transition, ~0.05 s per SOP
+sweep = Campaign.Sweep({"nsop": nsops, "ds": [round(ds) for ds in disc_spd]}, repetitions=rep,
+                       costs={"ds": 2.0}, point_time=lambda p: 0.05*p["nsop"], outer=["rep"])
+points = sweep.plan()
+sweep.printEstimate(points)
+# Repetitions of an (nsop, rate) stop once its mean OSNR is known within +/-0.05 dB (95 %)
+stats = RunningStats.RunningStats({"osnr": (20, 60), "power": (-30, 10)}, targets={"osnr": 0.05}, min_count=3)
+# Completed points, a restarted run resumes at the first unfinished one
+journal = Campaign.Journal("C:/OSA/2024-04-18_disc_journal.jsonl")
+for done_point, result in journal.items():
+    stats.add((done_point["nsop"], done_point["ds"]), **result)
 times = []
 time.sleep(warmup)
-for k in range(rep):
-    for nsop in nsops:
-        for i in range(len(disc_spd)):
-            ds = round(disc_spd[i])
-            mpc_201.setDisc()
-            time.sleep(1)
-            mpc_201.setRate(ds)
-            time.sleep(1)
-            osa.inband_Analysis([1545, 1555], nsop, "C:/OSA/2024-04-18_disc_"+str(ds)+"_"+str(k)+"_"+str(nsop)+".xosawdm")
-            time.sleep(1)
-            now = datetime.now()
-
-            current_time = now.strftime("%H:%M:%S")
-            print("Current Time =", current_time)
-            print('NSOP: '+str(nsop))
-            print('Scrambling rate: '+str(ds))
-            print('Repetition: '+str(k))
-            times.append(current_time)
+mpc_201.setDisc()
+ds_prev = None
+for point in points:
+    k, nsop, ds = point["rep"], point["nsop"], point["ds"]
+    if stats.done((nsop, ds)) or journal.done(point):
+        continue
+    if ds != ds_prev:
+        mpc_201.setRate(ds)
+        time.sleep(2)
+        ds_prev = ds
+    osa.inband_Analysis([1545, 1555], nsop, "C:/OSA/2024-04-18_disc_"+str(ds)+"_"+str(k)+"_"+str(nsop)+".xosawdm")
+    results = osa.getResults()
+    result = {"osnr": results["ch_osnr"][0], "power": results["ch_power"][0]}
+    journal.record(point, result)
+    stats.add((nsop, ds), **result)
+    now = datetime.now()
 
+    current_time = now.strftime("%H:%M:%S")
+    print("Current Time =", current_time)
+    print('NSOP: '+str(nsop))
+    print('Scrambling rate: '+str(ds))
+    print('Repetition: '+str(k))
+    times.append(current_time)
+
+journal.close()
+stats.printSummary()
 mpc_201.setRate(0)
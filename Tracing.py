@@ -0,0 +1,139 @@
+"""
+Per-command latency tracing of the instrument drivers
+Every SCPI write/query sent through an LTB transport or a pooled VISA
+session, every completion/settle wait and every fixed pause of the drivers
+is recorded as a span (kind, instrument, command, bytes, start, duration)
+when tracing is enabled
+
+1. Low overhead in-memory histograms per (kind, instrument, command header)
+2. Export of the retained spans as Chrome trace JSON (chrome://tracing,
+   Perfetto) or CSV
+3. Summary of the top time consumers, optionally printed at exit
+
+Example:
+    InstrumentControl.tracer.enable(summary_at_exit=True)
+    ...
+    InstrumentControl.tracer.exportChrome("run_trace.json")
+"""
+# Import library for the exit summary
+import atexit
+# Import libraries for the trace exports
+import csv
+import json
+# Import libraries for the span buffer and its lock
+import collections
+import threading
+# Import library for the span timestamps
+import time
+
+# Aggregated durations of one (kind, instrument, command header)
+class _Histogram:
+    __slots__ = ("count", "total", "max", "bytes", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.buckets = collections.Counter() # power of two buckets in us
+
+    def add(self, duration, nbytes):
+        self.count += 1
+        self.total += duration
+        self.bytes += nbytes
+        if duration > self.max:
+            self.max = duration
+        self.buckets[max(int(duration*1e6), 1).bit_length()] += 1
+
+    # Method returning the approximate q quantile (s) from the buckets
+    def quantile(self, q):
+        target = q*self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                return min((1 << bucket)*1e-6, self.max)
+        return self.max
+
+class Tracer:
+    # max_spans bounds the number of spans kept for export, histograms keep
+    # counting once the buffer is full
+    def __init__(self, max_spans=1000000):
+        self.enabled = False
+        self.spans = collections.deque(maxlen=max_spans)
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._atexit = False
+
+    def enable(self, summary_at_exit=False):
+        self.enabled = True
+        if summary_at_exit and not self._atexit:
+            atexit.register(self.summary)
+            self._atexit = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+            self.histograms.clear()
+
+    # Method recording a span, kind is "write", "query", "read", "wait" or "sleep"
+    def record(self, kind, instrument, command, start, duration, nbytes=0):
+        # Commands are aggregated without their arguments, waits and sleeps by label
+        key = (kind, instrument, command if kind in ("wait", "sleep") else command.split(" ")[0])
+        with self._lock:
+            self.spans.append((kind, instrument, command, start - self._t0, duration, nbytes, threading.get_ident()))
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = _Histogram()
+            hist.add(duration, nbytes)
+
+    # Method pausing for seconds, recorded as a sleep span
+    def sleep(self, seconds, instrument="", label="sleep"):
+        start = time.perf_counter()
+        time.sleep(seconds)
+        if self.enabled:
+            self.record("sleep", instrument, label, start, time.perf_counter() - start)
+
+    # Method printing the top time consumers
+    def summary(self, top=15):
+        with self._lock:
+            items = sorted(self.histograms.items(), key=lambda kv: -kv[1].total)
+        total = sum(h.total for _, h in items)
+        print("=== Instrument time by command ("+str(round(total, 3))+" s traced)")
+        print("%-6s %-24s %-32s %8s %10s %6s %10s %10s" % ("kind", "instrument", "command", "count", "total s", "%", "p50 ms", "max ms"))
+        for (kind, instrument, command), h in items[:top]:
+            print("%-6s %-24s %-32s %8d %10.3f %6.1f %10.3f %10.3f" % (kind, instrument[:24], command[:32], h.count, h.total,
+                                                                     100*h.total/total if total else 0,
+                                                                     h.quantile(0.5)*1e3, h.max*1e3))
+
+    # Method writing the retained spans as Chrome trace JSON, one track per instrument
+    def exportChrome(self, path):
+        with self._lock:
+            spans = list(self.spans)
+        tids = {}
+        events = []
+        for kind, instrument, command, start, duration, nbytes, thread in spans:
+            if instrument not in tids:
+                tids[instrument] = len(tids)
+                events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": tids[instrument],
+                               "args": {"name": instrument or "driver"}})
+            events.append({"name": command, "cat": kind, "ph": "X", "pid": 0, "tid": tids[instrument],
+                           "ts": start*1e6, "dur": duration*1e6, "args": {"bytes": nbytes, "thread": thread}})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    # Method writing the retained spans as CSV
+    def exportCSV(self, path):
+        with self._lock:
+            spans = list(self.spans)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["kind", "instrument", "command", "start_s", "duration_s", "bytes", "thread"])
+            writer.writerows(spans)
+
+# Process wide tracer used by the drivers
+tracer = Tracer()
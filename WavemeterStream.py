@@ -0,0 +1,181 @@
+"""
+Background wavelength streaming of the Keysight 86122 wavemeter
+A worker thread triggers single measurements of the wavemeter back to back
+(every sample is a new measurement, the continuous mode would return the
+same one until the next completes), parses the multi-peak replies into
+floats and keeps the samples in a fixed-size timestamped ring
+buffer, with running statistics of the first peak (mean, std and Allan
+deviation) updated sample by sample; memory stays constant however long
+the run, and the calling script only reads snapshots
+
+Example:
+    wlm = InstrumentControl.Keysight86122(3, 2)
+    with WavemeterStream.WavemeterStream(wlm, size=100000) as stream:
+        time.sleep(3600)
+        print(stream.stats())
+        t, wl = stream.snapshot()
+"""
+# Import libraries for the acquisition thread and its lock
+import threading
+import time
+import numpy as np
+# Import library for the per-platform command lock
+import AsyncInstrumentControl
+
+# Fixed-size ring buffer of timestamped rows of width values
+class RingBuffer:
+    def __init__(self, size, width=1):
+        self.size = size
+        self.t = np.zeros(size)
+        self.values = np.full((size, width), np.nan)
+        self.count = 0 # samples appended since the start, not capped
+
+    def append(self, t, row):
+        i = self.count % self.size
+        self.t[i] = t
+        self.values[i] = np.nan
+        n = min(len(row), self.values.shape[1])
+        self.values[i, :n] = row[:n]
+        self.count += 1
+
+    # Method returning copies of the retained samples, oldest first
+    def data(self):
+        if self.count <= self.size:
+            return self.t[:self.count].copy(), self.values[:self.count].copy()
+        i = self.count % self.size
+        return np.roll(self.t, -i), np.roll(self.values, -i, axis=0)
+
+# Running non-overlapping Allan deviation at averaging factors m (samples)
+# Each factor only keeps its current block sum and the previous block mean
+class AllanDeviation:
+    def __init__(self, factors):
+        self.factors = list(factors)
+        self._sum = np.zeros(len(self.factors))
+        self._n = np.zeros(len(self.factors), dtype=np.int64)
+        self._prev = np.full(len(self.factors), np.nan)
+        self._acc = np.zeros(len(self.factors))
+        self._pairs = np.zeros(len(self.factors), dtype=np.int64)
+        self._m = np.array(self.factors)
+
+    def add(self, value):
+        self._sum += value
+        self._n += 1
+        full = self._n == self._m
+        if full.any():
+            mean = self._sum[full]/self._m[full]
+            prev = self._prev[full]
+            ok = ~np.isnan(prev)
+            self._acc[np.flatnonzero(full)[ok]] += (mean[ok] - prev[ok])**2
+            self._pairs[np.flatnonzero(full)[ok]] += 1
+            self._prev[full] = mean
+            self._sum[full] = 0
+            self._n[full] = 0
+
+    # Method returning [(m, adev)] for the factors with at least one pair
+    def deviation(self):
+        return [(m, float(np.sqrt(self._acc[i]/(2*self._pairs[i]))))
+                for i, m in enumerate(self.factors) if self._pairs[i]]
+
+# Streaming acquisition of a Keysight86122 driver in a background thread
+# size is the number of retained samples, max_peaks the number of peaks kept
+# per sample, interval (s) an optional pause between measurements (0
+# measures as fast as the instrument can); the Allan deviation is computed at
+# averaging factors 1, 2, 4 ... up to max_factor samples
+# store is an optional ResultStore with "t" and "wl" columns receiving every
+# first peak sample, for runs longer than the ring buffer
+class WavemeterStream:
+    def __init__(self, wlm, size=100000, max_peaks=4, interval=0, max_factor=65536, store=None):
+        self.wlm = wlm
+        self.interval = interval
+        self.store = store
+        self.buffer = RingBuffer(size, max_peaks)
+        self.allan = AllanDeviation([2**k for k in range(max_factor.bit_length()) if 2**k <= max_factor])
+        self.error = None
+        self._n = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._t_first = None
+        self._t_last = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _add(self, t, wls):
+        with self._lock:
+            self.buffer.append(t, wls)
+            if len(wls) and np.isfinite(wls[0]):
+                # Welford update of the first peak mean and variance
+                self._n += 1
+                delta = wls[0] - self._mean
+                self._mean += delta/self._n
+                self._m2 += delta*(wls[0] - self._mean)
+                self.allan.add(wls[0])
+                if self._t_first is None:
+                    self._t_first = t
+                self._t_last = t
+        if self.store is not None and len(wls):
+            self.store.append(t=t, wl=wls[0])
+
+    def _run(self):
+        lock = AsyncInstrumentControl.platformLock(self.wlm)
+        try:
+            with lock:
+                self.wlm.setContinuous(False)
+            while not self._stop.is_set():
+                with lock:
+                    wls = self.wlm.measure()
+                self._add(time.time(), wls)
+                if self.interval:
+                    self._stop.wait(self.interval)
+        except Exception as e:
+            self.error = e
+        finally:
+            # Give the front panel its continuous display back
+            try:
+                with lock:
+                    self.wlm.setContinuous(True)
+            except Exception:
+                pass
+            if self.store is not None:
+                self.store.flush()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Method returning copies of the retained (t, wavelengths) samples,
+    # wavelengths has one column per peak
+    def snapshot(self):
+        with self._lock:
+            return self.buffer.data()
+
+    # Method returning the running statistics of the first peak (m), the
+    # Allan deviation as [(tau s, adev m)] using the mean sample interval
+    def stats(self):
+        with self._lock:
+            n = self._n
+            dt = (self._t_last - self._t_first)/(n - 1) if n > 1 else 0.0
+            return {"samples": n,
+                    "rate_hz": 1/dt if dt else 0.0,
+                    "mean": self._mean if n else np.nan,
+                    "std": np.sqrt(self._m2/(n - 1)) if n > 1 else np.nan,
+                    "allan": [(m*dt, adev) for m, adev in self.allan.deviation()],
+                    "error": repr(self.error) if self.error else None}
@@ -1,4 +1,6 @@
 import InstrumentControl
+import RunningStats
+import Campaign
 import numpy as np
 import time
 
@@ -11,15 +13,37 @@ scr_arr = 2**(np.linspace(0, 14, 15))-1
 
 n_acq = 5000
 n_av = 2
+# A rate stops early once its mean OSNR is known within +/-0.02 dB (95 %)
+stats = RunningStats.RunningStats({"osnr": (20, 60), "power": (-30, 10)}, targets={"osnr": 0.02}, min_count=50)
+# Completed acquisitions, a restarted run resumes after the last one
+journal = Campaign.Journal("C:/OSA/2024-04-05_av_journal.jsonl")
+for (rate, i), result in journal.items():
+    stats.add(rate, **result)
 
 for scrambling_rate in scr_arr:
     for i in range(n_acq):
+        if stats.done(scrambling_rate):
+            break
+        if journal.done((scrambling_rate, i)):
+            continue
         mpc_201.setRate(scrambling_rate)
         time.sleep(1)
         mpc_201.setRate(0)
         time.sleep(1)
-        osa.inband_Analysis([1545, 1555], n_av, "C:/OSA/2024-04-05_av_"+str(scrambling_rate)+"_"+str(i)+".xosawdm")
+        # Trace and WDM results go straight to one local store per rate, no file on the instrument disk
+        osa.inband_Analysis([1545, 1555], n_av, store="C:/OSA/2024-04-05_av_"+str(scrambling_rate))
         time.sleep(1)
+        # The record is on disk before the acquisition is journaled
+        osa.store.flush()
+        result = {"osnr": osa.results["ch_osnr"][0], "power": osa.results["ch_power"][0]}
+        journal.record((scrambling_rate, i), result)
+        stats.add(scrambling_rate, **result)
+    if osa.store is not None:
+        osa.store.close()
+    stats.save("C:/OSA/2024-04-05_av_stats.json")
+journal.close()
+
+stats.printSummary()
 
 
 mpc_201.setRate(0)
@@ -1,32 +1,43 @@
 import InstrumentControl
-import pyvisa
+import AsyncInstrumentControl
+import ResultStore
+import Calibration
+import asyncio
 import time
-import numpy as np
-t100shp = InstrumentControl.T100(9,1)
-osa = InstrumentControl.Yokogawa(16,0)
-wlm = InstrumentControl.Keysight86122(3,2)
-
-wls = np.linspace(1440, 1640, 1640-1440+1)
-
-osa_id = osa.platform.query("*IDN?")
-
-
-f = open(osa_id[:-2]+".txt", "w")
-f.write("T100S-HP,OSA,WLM\n")
-for wl in wls:
-    t100shp.setWL(wl)
-    time.sleep(1)
-    osa.setSweepCenter(wl)
-    osa.setSweepSpan(2)
-    osa.setSweepPoints(5000)
-    osa.sweep()
-    osa_peak = osa.getPeaks(-20)
-    osa_peak = osa_peak.split(",")[0]
-    wlm_peak = wlm.getWL()
-    f.write(str(wl)+","+str(osa_peak)+","+str(wlm_peak))
-
-    
-
-
-
 
+async def main():
+    # Instruments sit on separate GPIB boards, their initialization overlaps
+    t100shp, osa, wlm = await asyncio.gather(
+        AsyncInstrumentControl.openAsync(InstrumentControl.T100, 9, 1, settle=True),
+        AsyncInstrumentControl.openAsync(InstrumentControl.Yokogawa, 16, 0, correct=False),
+        AsyncInstrumentControl.openAsync(InstrumentControl.Keysight86122, 3, 2))
+
+    # Coarse 8 nm grid refined (8, 4, 2, 1 nm) down to the former 1 nm step
+    # where the OSA error is off from its neighbours or the fit by more than
+    # 3 times the fit residual of the coarse pass (the OSA/WLM repeatability,
+    # about 2.7 pm rms on this AQ6370D)
+    grid = Calibration.AdaptiveGrid(1440, 1640, coarse=26, tol=None, min_step=1, max_points=201)
+
+    osa_id = osa.platform.query("*IDN?").strip()
+
+    # setpoint in nm, osa and wlm peaks in m, t in s since epoch
+    # Each run gets its own store so the model is fitted on this run only
+    store = ResultStore.ResultStore(osa_id+"_"+time.strftime("%Y-%m-%d_%H%M%S"),
+                                    {"setpoint": "f8", "osa": "f8", "wlm": "f8", "t": "f8"},
+                                    attrs={"source": "T100S-HP", "osa_idn": osa_id,
+                                           "wlm_idn": wlm.platform.query("*IDN?").strip()})
+
+    def record(wl, osa_peak, wlm_peak):
+        store.append(setpoint=wl, osa=float(osa_peak.split(",")[0]), wlm=float(wlm_peak.split(",")[0]), t=time.time())
+
+    await AsyncInstrumentControl.adaptiveCalibrationScan(t100shp, osa, wlm, grid, peak_thresh=-20, span=2, pts=5000, record=record)
+    store.close()
+    grid.printSummary()
+
+    # Correction model of the OSA, used by Yokogawa.getPeaks() from now on
+    setpoint, osa_wl, wlm_wl = Calibration.loadResults(store.path)
+    model = Calibration.fit(osa_wl, wlm_wl, kind="poly", deg=5, idn=osa_id)
+    model.printReport()
+    print("Model saved to "+str(model.save()))
+
+asyncio.run(main())
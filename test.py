@@ -1,30 +1,30 @@
 import InstrumentControl
-import numpy as np
-ltb8 = InstrumentControl.LTB('169.254.244.64', 5025).platform
-tla = InstrumentControl.TLS('LTB8', ltb8, 0)
+import AsyncInstrumentControl
+import ResultStore
+import asyncio
 import time
-osa = InstrumentControl.Yokogawa(1)
-osa.setSweepSpan(5)
-osa.setSweepPoints(20000)
-
-wlm = InstrumentControl.Keysight86122(2)
+import numpy as np
 
-wlm.setPeakThreshold(0)
+async def main():
+    ltb8 = InstrumentControl.LTB('169.254.244.64', 5025).platform
+    tla, osa, wlm = await asyncio.gather(
+        AsyncInstrumentControl.openAsync(InstrumentControl.TLS, 'LTB8', ltb8, 0, settle=True),
+        AsyncInstrumentControl.openAsync(InstrumentControl.Yokogawa, 1),
+        AsyncInstrumentControl.openAsync(InstrumentControl.Keysight86122, 2))
+    await wlm.setPeakThreshold(0)
 
-f = open('results.csv', 'w')
+    # setpoint in nm, osa and wlm peaks in m, t in s since epoch
+    # A new store per run, reruns do not append to the previous results
+    store = ResultStore.ResultStore('results_'+time.strftime('%Y-%m-%d_%H%M%S'),
+                                    {'setpoint': 'f8', 'osa': 'f8', 'wlm': 'f8', 't': 'f8'},
+                                    attrs={'osa_idn': osa.platform.query('*IDN?').strip(),
+                                           'wlm_idn': wlm.platform.query('*IDN?').strip()})
 
-f.write('asked wl,osa wl,wlm wl\n')
+    def record(wl, osa_peaks, wl3):
+        store.append(setpoint=wl, osa=float(osa_peaks.split(',')[0]), wlm=float(wl3.split(',')[0]), t=time.time())
 
+    await AsyncInstrumentControl.calibrationScan(tla, osa, wlm, np.linspace(1545, 1560, 10), peak_thresh=0, span=5,
+                                                 wl_scale=1e-9, record=record, accuracy=0.5)
+    store.close()
 
-for wl in np.linspace(1545, 1560, 10):
-    tla.setWL(wl*1e-9)
-    osa.setSweepCenter(wl)
-    time.sleep(1)
-    osa.sweep()
-    time.sleep(1)
-    wl2 = osa.getPeaks(0).split(',')[0]
-    time.sleep(1)
-    wl3 = wlm.getWL()
-    time.sleep(1)
-    f.write(str(wl)+','+str(wl2)+','+str(wl3))
-    time.sleep(1)
+asyncio.run(main())
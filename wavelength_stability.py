@@ -1,8 +1,31 @@
 import InstrumentControl
-import pyvisa
+import ResultStore
+import time
 
-rm = pyvisa.ResourceManager()
-print(rm.list_resources())
+duration = 12*3600 # s
+report_every = 60 # s
 
+wlm = InstrumentControl.Keysight86122(3, 2)
+wlm.setPeakThreshold(10)
 
-osa = InstrumentControl
\ No newline at end of file
+# Every sample goes to disk, the last 100000 stay in memory for the statistics
+store = ResultStore.ResultStore("wavelength_stability", {"t": "f8", "wl": "f8"},
+                                attrs={"wlm_idn": wlm.platform.query("*IDN?").strip()})
+stream = wlm.stream(size=100000, store=store)
+start = time.time()
+try:
+    while time.time() - start < duration and stream.running:
+        time.sleep(report_every)
+        stats = stream.stats()
+        print(str(int(time.time() - start))+" s, "+str(stats["samples"])+" samples at "+str(round(stats["rate_hz"], 1))+" Hz, "
+              +"mean "+str(round(stats["mean"]*1e9, 6))+" nm, std "+str(round(stats["std"]*1e12, 3))+" pm")
+finally:
+    stream.stop()
+    store.close()
+
+stats = stream.stats()
+if stats["error"]:
+    print("Acquisition stopped: "+stats["error"])
+print("Allan deviation:")
+for tau, adev in stats["allan"]:
+    print("  tau "+str(round(tau, 3))+" s: "+str(round(adev*1e12, 4))+" pm")